@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pick a consensus translation for each task from its task runs.
+
+Every answer is turned into a vector of hashed word unigrams and
+bigrams.  The answers of BATCH_TASKS tasks at a time are stacked into
+one NumPy array, normalized, and multiplied by their transpose, which
+gives the cosine similarity of every pair of answers of each task.  The
+consensus is the answer most similar on average to the task's other
+answers, and that average is its agreement score, between 0 and 1.
+
+Task runs come in the order they were submitted.  group_taskruns()
+spools them to a temporary SQLite database and reads them back a task
+at a time, so memory does not grow with the number of runs.
+
+Needs numpy (pip install numpy); without it NUMPY is False.
+"""
+
+import csv
+import json
+import os
+import re
+import sqlite3
+import tempfile
+
+try:
+    import numpy
+    NUMPY = True
+except ImportError:
+    NUMPY = False
+
+import stats
+from bulk import csv_cell
+from bulk import file_format
+from export import iter_pages
+
+# The translation in the answer saved by template.html.
+ANSWER_FIELD = 'english'
+
+# Length of the hashed feature vectors (a power of two).
+DIMENSIONS = 1024
+
+# Tasks scored per array multiplication.
+BATCH_TASKS = 256
+
+FIELDS = ('task_id', 'n_runs', 'n_answers', 'agreement', 'taskrun_id',
+          'consensus')
+
+WORDS = re.compile(ur'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercase words of an answer."""
+    return WORDS.findall(text.lower())
+
+
+def features(text):
+    """Hashes of the word unigrams and bigrams of text."""
+    words = tokenize(text)
+    return map(hash, words) + map(hash, zip(words, words[1:]))
+
+
+def answer_text(taskrun_info):
+    """The translation of a task run's info, or u'' if there is none."""
+    answer = taskrun_info
+    if isinstance(answer, dict):
+        answer = answer.get(ANSWER_FIELD)
+    if not isinstance(answer, basestring):
+        return u''
+    if isinstance(answer, str):
+        answer = answer.decode('utf-8', 'replace')
+    return answer.strip()
+
+
+def score_batch(groups, dimensions=DIMENSIONS):
+    """Agreement of each answer of each group with the group's others.
+
+    groups is a list of lists of answer texts.  Returns a (groups,
+    answers) array of mean cosine similarities, -1 where a group has no
+    such answer or the answer has no words.
+    """
+    width = max(len(texts) for texts in groups)
+    hashes = []
+    rows = []
+    lengths = []
+    for g, texts in enumerate(groups):
+        for a, text in enumerate(texts):
+            answer = features(text)
+            hashes.extend(answer)
+            rows.append(g * width + a)
+            lengths.append(len(answer))
+    # Row of each feature times the row length, plus its column.
+    index = numpy.repeat(numpy.array(rows, dtype=numpy.int64), lengths)
+    index *= dimensions
+    index += numpy.array(hashes, dtype=numpy.int64) & (dimensions - 1)
+    counts = numpy.bincount(index, minlength=len(groups) * width * dimensions)
+    vectors = counts.astype(numpy.float32).reshape(len(groups), width,
+                                                   dimensions)
+
+    norms = numpy.sqrt((vectors * vectors).sum(axis=2))
+    valid = norms > 0
+    vectors /= numpy.where(valid, norms, 1)[:, :, numpy.newaxis]
+    similarity = numpy.matmul(vectors, vectors.transpose(0, 2, 1))
+
+    # Pairs of two different answers that both have words.
+    pairs = valid[:, :, numpy.newaxis] & valid[:, numpy.newaxis, :]
+    pairs &= ~numpy.eye(width, dtype=bool)
+    others = pairs.sum(axis=2)
+    mean = (similarity * pairs).sum(axis=2) / numpy.maximum(others, 1)
+    return numpy.where(valid, mean, -1)
+
+
+def consensus(tasks, batch=BATCH_TASKS, dimensions=DIMENSIONS):
+    """Yield a result dict (see FIELDS) for each (task_id, runs) in tasks.
+
+    runs is a list of (taskrun_id, answer text).  A task with a single
+    answer gets it as consensus with agreement 0; one without any gets
+    None.
+    """
+    def flush(pending):
+        with stats.timer('score_batch'):
+            scores = score_batch([[text for taskrun_id, text in runs]
+                                  for task_id, runs in pending], dimensions)
+        for (task_id, runs), row in zip(pending, scores):
+            best = int(row.argmax())
+            result = dict(task_id=task_id, n_runs=len(runs),
+                          n_answers=int((row[:len(runs)] >= 0).sum()),
+                          agreement=0.0, taskrun_id=None, consensus=None)
+            if row[best] >= 0:
+                result.update(agreement=round(float(row[best]), 4),
+                              taskrun_id=runs[best][0],
+                              consensus=runs[best][1])
+            stats.incr('tasks_aggregated')
+            yield result
+
+    pending = []
+    for task_id, runs in tasks:
+        if runs:
+            pending.append((task_id, runs))
+        if len(pending) == batch:
+            for result in flush(pending):
+                yield result
+            pending = []
+    if pending:
+        for result in flush(pending):
+            yield result
+
+
+def group_taskruns(taskruns, tmpdir=None):
+    """Yield (task_id, [(taskrun_id, answer text)]) from task run dicts.
+
+    Tasks come in task id order and runs in task run id order.  The
+    spool file is created in `tmpdir` and removed when done.
+    """
+    fd, path = tempfile.mkstemp(prefix='aggregate', suffix='.sqlite',
+                                dir=tmpdir)
+    os.close(fd)
+    db = sqlite3.connect(path)
+    try:
+        db.execute('CREATE TABLE runs (task_id INTEGER, taskrun_id INTEGER, '
+                   'answer TEXT)')
+        with stats.timer('spool_taskruns'):
+            db.executemany('INSERT INTO runs VALUES (?, ?, ?)',
+                           ((taskrun['task_id'], taskrun['id'],
+                             answer_text(taskrun.get('info')))
+                            for taskrun in taskruns))
+            db.execute('CREATE INDEX runs_by_task ON runs (task_id, '
+                       'taskrun_id)')
+            db.commit()
+        task_id, runs = None, []
+        for row in db.execute('SELECT task_id, taskrun_id, answer FROM runs '
+                              'ORDER BY task_id, taskrun_id'):
+            if row[0] != task_id and runs:
+                yield task_id, runs
+                runs = []
+            task_id = row[0]
+            runs.append((row[1], row[2]))
+        if runs:
+            yield task_id, runs
+    finally:
+        db.close()
+        os.remove(path)
+
+
+def server_taskruns(app_id, workers=1):
+    """The app's task runs, fetched page by page."""
+    for offset, taskruns in iter_pages('taskrun', app_id, workers=workers):
+        for taskrun in taskruns:
+            yield taskrun.data
+
+
+def exported_taskruns(path):
+    """The task runs of a file written by export.export_results()."""
+    with open(path, 'rb') as fp:
+        if file_format(path) == 'csv':
+            for row in csv.DictReader(fp):
+                if row['domain'] == 'taskrun':
+                    row['id'] = int(row['id'])
+                    row['task_id'] = int(row['task_id'])
+                    row['info'] = json.loads(row['info'] or 'null')
+                    yield row
+        else:
+            for line in fp:
+                row = json.loads(line)
+                if row['domain'] == 'taskrun':
+                    yield row
+
+
+def write_consensus(path, results):
+    """Write results to path, as CSV or one JSON object per line.
+
+    Returns the number of tasks written.
+    """
+    n = 0
+    with open(path, 'wb') as fp:
+        if file_format(path) == 'csv':
+            writer = csv.writer(fp)
+            writer.writerow(FIELDS)
+            for n, result in enumerate(results, 1):
+                writer.writerow([csv_cell(result[field]) for field in FIELDS])
+        else:
+            for n, result in enumerate(results, 1):
+                fp.write(json.dumps(result) + '\n')
+    return n
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rate limits, retries and adaptive concurrency for pbclient requests.
+
+install() puts a RetryingSession where task_pool.use_session() puts its
+Session, so every pbclient call goes through it:
+
+    TokenBucket    at most `rate` requests a second, in bursts of `burst`
+    AdaptiveLimit  at most `limit` requests in flight.  The limit grows
+                   by one per `limit` fast responses and halves when a
+                   response is slower than target_latency or the server
+                   is overloaded (429, 503)
+    retries        after 429, 5xx, timeouts and connection errors, with
+                   exponential backoff and full jitter, at least as long
+                   as the server's Retry-After
+
+GET, PUT (pbclient.update_task sends the whole task) and DELETE are
+idempotent and retried on any of these.  A POST (pbclient.create_task)
+is only retried when the server cannot have created the task: 429, 503
+or no connection.  After any other failure the task may exist, so the
+call fails and the message stays journalled as parsed under its key,
+for the next run to post.
+"""
+
+import random
+import threading
+import time
+
+import pbclient
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+import stats
+import task_pool
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Statuses after which the server did not act on the request.
+REJECTED_STATUSES = (429, 503)
+
+RETRIES = 3
+
+# Seconds before the first retry, doubling after each one.
+BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+# Seconds before a request is given up on.
+TIMEOUT = 60.0
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until there is one."""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # Reserve the token now and wait for it outside the lock.
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            stats.incr('http_rate_limited')
+            time.sleep(wait)
+
+
+class AdaptiveLimit(object):
+
+    def __init__(self, maximum, target_latency=None, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.target_latency = target_latency
+        self.limit = float(maximum)
+        self.active = 0
+        self.last_decrease = 0
+        self.ready = threading.Condition()
+
+    def acquire(self):
+        with self.ready:
+            while self.active >= int(self.limit):
+                self.ready.wait()
+            self.active += 1
+
+    def release(self, latency, overloaded=False):
+        with self.ready:
+            self.active -= 1
+            slow = self.target_latency and latency > self.target_latency
+            if overloaded or slow:
+                # Responses already in flight were slow for the same
+                # reason: halve at most once per target latency.
+                now = time.time()
+                if now - self.last_decrease > (self.target_latency or 1):
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+                    stats.incr('http_concurrency_decreased')
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.ready.notify_all()
+
+
+class RetryingSession(object):
+    """The get/post/put/delete of a Session, limited and retried."""
+
+    def __init__(self, session, bucket=None, limit=None, retries=RETRIES,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, timeout=TIMEOUT):
+        self.session = session
+        self.bucket = bucket
+        self.limit = limit
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            response, error = self.send(method, url, **kwargs)
+            if attempt == self.retries or not self.retryable(method, response,
+                                                             error):
+                if error is not None:
+                    raise error
+                return response
+            attempt += 1
+            stats.incr('http_retries')
+            time.sleep(self.delay(attempt, response))
+
+    def send(self, method, url, **kwargs):
+        """(response, None), or (None, exception) if there was none."""
+        if self.bucket is not None:
+            self.bucket.acquire()
+        if self.limit is not None:
+            self.limit.acquire()
+        start = time.time()
+        response = error = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException, error:
+            stats.error('http_%s' % method.lower())
+        finally:
+            if self.limit is not None:
+                overloaded = response is None \
+                    or response.status_code in REJECTED_STATUSES
+                self.limit.release(time.time() - start, overloaded)
+        return response, error
+
+    def retryable(self, method, response, error):
+        if method != 'POST':
+            return error is not None or response.status_code in RETRY_STATUSES
+        # The task may have been created unless the request never
+        # reached the server or was turned away.
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if error is not None:
+            # Connection refused: urllib3 gave up before sending.
+            reason = getattr(error.args[0] if error.args else None,
+                             'reason', None)
+            return isinstance(reason, NewConnectionError)
+        return response.status_code in REJECTED_STATUSES
+
+    def delay(self, attempt, response):
+        """Full jitter backoff, no shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** (attempt - 1)))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers['Retry-After']))
+            except (KeyError, ValueError):
+                pass
+        return delay
+
+
+def install(workers, rate=None, burst=None, retries=RETRIES,
+            target_latency=None):
+    """Send pbclient's requests through a RetryingSession.
+
+    At most `workers` requests are in flight, fewer while responses are
+    slower than target_latency seconds.  rate is in requests a second.
+    """
+    # One more connection than workers for the task page prefetch.
+    session = task_pool.use_session(workers + 1)
+    bucket = TokenBucket(rate, burst or workers) if rate else None
+    limit = AdaptiveLimit(workers + 1, target_latency)
+    pbclient.requests = RetryingSession(session, bucket, limit, retries)
+    return pbclient.requests
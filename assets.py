@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Upload the app's presenter, tutorial and description only when changed.
+
+The manifest is a JSON file recording, for one server and app short
+name, the app id and the SHA-1 of every field as last uploaded:
+
+    {"endpoint": ..., "short_name": ..., "app_id": 7,
+     "hashes": {"task_presenter": "...", ...}}
+
+With minify the HTML is sent without comments, indentation and blank
+lines, so every volunteer downloads a smaller presenter.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+# App fields and the files they are read from.  thumbnail comes from
+# app.json, and all but long_description live in app.info.
+FILES = (('long_description', 'long_description.html'),
+         ('task_presenter', 'template.html'),
+         ('tutorial', 'tutorial.html'))
+
+INFO_FIELDS = ('task_presenter', 'tutorial', 'thumbnail')
+
+# Whitespace in these elements is content.
+_PRESERVED = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.DOTALL | re.IGNORECASE)
+
+# Comments, but not IE conditional comments.
+_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+
+
+def minify_html(text):
+    """text without HTML comments, whole-line // comments, indentation
+    and blank lines.  Line breaks are kept, for JavaScript's sake."""
+    pieces = _PRESERVED.split(text)
+    out = []
+    # split() returns text, then the element and its tag name, in turn.
+    for i in xrange(0, len(pieces), 3):
+        lines = []
+        for line in _COMMENT.sub('', pieces[i]).splitlines():
+            line = line.strip()
+            if line and not line.startswith('//'):
+                lines.append(line)
+        out.append('\n'.join(lines))
+        if i + 1 < len(pieces):
+            out.append(pieces[i + 1])
+    return ''.join(out)
+
+
+def app_fields(app_config, minify=False):
+    """The app fields to upload, by name."""
+    fields = {}
+    for field, path in FILES:
+        with open(path) as fp:
+            text = fp.read()
+        fields[field] = minify_html(text) if minify else text
+    fields['thumbnail'] = app_config['thumbnail']
+    return fields
+
+
+def digest(value):
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return hashlib.sha1(value).hexdigest()
+
+
+class Manifest(object):
+
+    def __init__(self, path, endpoint, short_name):
+        self.path = path
+        self.endpoint = endpoint
+        self.short_name = short_name
+        self.app_id = None
+        self.hashes = {}
+        try:
+            with open(path) as fp:
+                manifest = json.load(fp)
+        except (IOError, ValueError):
+            return
+        # Another server or app: everything has to be uploaded.
+        if (manifest.get('endpoint') == endpoint
+                and manifest.get('short_name') == short_name):
+            self.app_id = manifest.get('app_id')
+            self.hashes = manifest.get('hashes', {})
+
+    def changed(self, fields):
+        """Names of the fields that differ from the last upload."""
+        return set(field for field, value in fields.iteritems()
+                   if self.hashes.get(field) != digest(value))
+
+    def reset(self):
+        self.app_id = None
+        self.hashes = {}
+
+    def save(self, app_id, fields):
+        self.app_id = app_id
+        self.hashes = dict((field, digest(value))
+                           for field, value in fields.iteritems())
+        with open(self.path + '.tmp', 'w') as fp:
+            json.dump(dict(endpoint=self.endpoint,
+                           short_name=self.short_name,
+                           app_id=app_id,
+                           hashes=self.hashes), fp, indent=1, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed store for email attachments.
+
+Attachment bodies are decoded a line at a time as lean_message reads
+them and written under their SHA-256:
+
+    ATTACHMENTS/ab/abcdef...
+
+so an image sent in many messages is stored once.  Tasks carry a small
+reference to each attachment instead of its data, with a URL if the
+directory is served over HTTP at `base_url`.
+"""
+
+import binascii
+import errno
+import hashlib
+import os
+import tempfile
+
+import stats
+
+
+def makedirs(path):
+    """os.makedirs(), but another --numcores process may get there first."""
+    try:
+        os.makedirs(path)
+    except OSError, err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+class AttachmentStore(object):
+
+    def __init__(self, path, base_url=None):
+        self.path = path
+        self.base_url = base_url
+
+    def filename(self, sha256):
+        return os.path.join(self.path, sha256[:2], sha256)
+
+    def writer(self, part):
+        """An AttachmentWriter for the body of the part with these headers."""
+        tmpdir = os.path.join(self.path, 'tmp')
+        if not os.path.isdir(tmpdir):
+            makedirs(tmpdir)
+        return AttachmentWriter(self, part, tmpdir)
+
+    def add(self, tmpname, sha256):
+        """Move a written attachment into place, unless it is already there."""
+        dest = self.filename(sha256)
+        if os.path.exists(dest):
+            os.remove(tmpname)
+            return False
+        if not os.path.isdir(os.path.dirname(dest)):
+            makedirs(os.path.dirname(dest))
+        os.rename(tmpname, dest)
+        return True
+
+    def reference(self, sha256, part, size):
+        ref = dict(sha256=sha256,
+                   content_type=part.get_content_type(),
+                   filename=part.get_filename(),
+                   size=size)
+        if self.base_url:
+            ref['url'] = '%s/%s/%s' % (self.base_url.rstrip('/'),
+                                       sha256[:2], sha256)
+        return ref
+
+
+class AttachmentWriter(object):
+    """Decode one part body line by line into the store."""
+
+    def __init__(self, store, part, tmpdir):
+        self.store = store
+        self.part = part
+        self.encoding = part.get('Content-Transfer-Encoding', '').lower()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.pending = ''   # Base64 characters short of a 4 byte group.
+        self.eol = ''
+        fd, self.tmpname = tempfile.mkstemp(dir=tmpdir)
+        self.fp = os.fdopen(fd, 'wb')
+
+    def write(self, line):
+        if self.encoding == 'base64':
+            self.pending += ''.join(line.split())
+            n = len(self.pending) - len(self.pending) % 4
+            data, self.pending = self.pending[:n], self.pending[n:]
+            try:
+                data = binascii.a2b_base64(data)
+            except binascii.Error:
+                data = ''
+        else:
+            # The line break before the closing boundary is not part of
+            # the body, so each one is only written once a line follows.
+            body = line.rstrip('\r\n')
+            eol = line[len(body):]
+            if self.encoding == 'quoted-printable':
+                if body.endswith('='):
+                    body, eol = body[:-1], ''   # Soft line break.
+                body = binascii.a2b_qp(body)
+            data, self.eol = self.eol + body, eol
+        self.sha256.update(data)
+        self.size += len(data)
+        self.fp.write(data)
+
+    def close(self):
+        """Store the attachment and return its reference."""
+        self.fp.close()
+        sha256 = self.sha256.hexdigest()
+        stats.incr('attachments')
+        if self.store.add(self.tmpname, sha256):
+            stats.incr('attachment_bytes_stored', self.size)
+        return self.store.reference(sha256, self.part, self.size)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.tmpname)
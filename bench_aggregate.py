@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time consensus aggregation on synthetic answers.
+
+Each task gets --answers translations: noisy copies of one sentence
+(dropped, swapped and misspelt words), a few unrelated ones and some
+"spam".  Reports tasks/second for aggregate.consensus() and how often
+the consensus is one of the noisy copies.
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import random
+import sys
+import time
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+import aggregate
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--tasks',
+                        help="Tasks to aggregate.",
+                        action="store",
+                        type=int,
+                        default=10000)
+    parser.add_argument('--answers',
+                        help="Answers per task.",
+                        action="store",
+                        type=int,
+                        default=30)
+    parser.add_argument('--batch',
+                        help="Tasks per array multiplication.",
+                        action="store",
+                        type=int,
+                        default=aggregate.BATCH_TASKS)
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+WORDS = (u'the water electricity checkpoint hospital bread family children '
+         u'army street night school road city village doctor help please '
+         u'shelling near house we are need no there is was today yesterday '
+         u'market fuel medicine closed open people many injured safe').split()
+
+
+def sentence(rng, n):
+    return [rng.choice(WORDS) for i in xrange(n)]
+
+
+def noisy(rng, words):
+    words = list(words)
+    for i in xrange(rng.randint(0, 3)):
+        j = rng.randrange(len(words))
+        change = rng.random()
+        if change < 0.3 and len(words) > 1:
+            del words[j]
+        elif change < 0.6:
+            k = rng.randrange(len(words))
+            words[j], words[k] = words[k], words[j]
+        else:
+            words[j] = words[j][:-1] + u'x'
+    return u' '.join(words)
+
+
+def make_tasks(rng, n_tasks, n_answers):
+    """(task_id, runs) like group_taskruns(), and the noisy answers."""
+    tasks = []
+    good = set()
+    taskrun_id = 0
+    for task_id in xrange(n_tasks):
+        words = sentence(rng, rng.randint(5, 40))
+        runs = []
+        for i in xrange(n_answers):
+            taskrun_id += 1
+            kind = rng.random()
+            if kind < 0.1:
+                text = u'spam'
+            elif kind < 0.2:
+                text = u' '.join(sentence(rng, rng.randint(3, 20)))
+            else:
+                text = noisy(rng, words)
+                good.add(taskrun_id)
+            runs.append((taskrun_id, text))
+        tasks.append((task_id, runs))
+    return tasks, good
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    rng = random.Random(0)
+    tasks, good = make_tasks(rng, args.tasks, args.answers)
+    logger.info('%d tasks of %d answers' % (args.tasks, args.answers))
+
+    start = time.time()
+    results = list(aggregate.consensus(tasks, args.batch))
+    elapsed = time.time() - start
+
+    right = sum(1 for result in results if result['taskrun_id'] in good)
+    agreement = sum(result['agreement'] for result in results) / len(results)
+    logger.info('%.2f s, %.0f tasks/s (%.1f min per 100k tasks)' % (
+        elapsed, len(results) / elapsed, elapsed * 1e5 / len(results) / 60))
+    logger.info('Consensus from the agreeing answers: %.1f%%, mean '
+                'agreement %.3f' % (100.0 * right / len(results), agreement))
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time header and charset decoding per header, with and without caches.
+
+Takes the Subject headers and part charsets of a synthetic corpus (see
+make_corpus.py) and compares, per call:
+
+    subject   decode_header() + unicode() on every subject, as before,
+              with charsets.decode_header_text()
+    charset   codecs.lookup() on every declared charset with
+              charsets.codec()
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import codecs
+import email
+import random
+import sys
+import time
+from email.header import decode_header
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+from make_corpus import make_message
+import charsets
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--messages',
+                        help="Messages to take headers from.",
+                        action="store",
+                        type=int,
+                        default=5000)
+    parser.add_argument('--repeat',
+                        help="Passes over the headers.",
+                        action="store",
+                        type=int,
+                        default=5)
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+def old_subject(subject):
+    return ''.join([unicode(t[0], t[1] or 'ascii')
+                    for t in decode_header(subject)])
+
+
+def old_codec(charset):
+    return codecs.lookup(charset).name
+
+
+def per_call(func, values, repeat):
+    """Mean seconds per func(value) over `repeat` passes."""
+    start = time.time()
+    for i in xrange(repeat):
+        for value in values:
+            func(value)
+    return (time.time() - start) / (repeat * len(values))
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    rng = random.Random(0)
+    now = time.time()
+    subjects = []
+    declared = []
+    for i in xrange(args.messages):
+        message = email.message_from_string(make_message(rng, i, now, 0))
+        subjects.append(message['Subject'])
+        declared.extend(part.get_content_charset() for part in message.walk()
+                        if part.get_content_charset())
+    encoded = sum(1 for subject in subjects if '=?' in subject)
+    logger.info('%d subjects (%d encoded, %d distinct), %d charsets' % (
+        len(subjects), encoded, len(set(subjects)), len(declared)))
+
+    for name, old, new, values in (
+            ('subject', old_subject, charsets.decode_header_text, subjects),
+            ('charset', old_codec, charsets.codec, declared)):
+        before = per_call(old, values, args.repeat)
+        after = per_call(new, values, args.repeat)
+        logger.info('%-8s %8.2f us -> %8.2f us per call  (%.1fx)' % (
+            name, 1e6 * before, 1e6 * after, before / after))
+
+    lru = charsets._headers
+    logger.info('Encoded subject cache: %d hits, %d misses' % (lru.hits,
+                                                               lru.misses))
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time createTasks.py -c, -x and -q runs against a local fake PyBossa.
+
+Starts pbfake.FakePyBossa with the requested latency and error rate,
+fills a throwaway Maildir and reports tasks/second, p50/p99 request
+latency and wall time for each run.  Tasks are counted on the server:
+those created by -c and -x, those updated by -q.  Only task and task
+run requests fail, so the app is always found.
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+from pbfake import FakePyBossa
+import bench_get_emails
+import createTasks
+import get_emails
+import task_pool
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--messages',
+                        help="Messages in the Maildir for each of -c and -x.",
+                        action="store",
+                        type=int,
+                        default=500)
+    parser.add_argument('--workers',
+                        help="createTasks.py --workers.",
+                        action="store",
+                        type=int,
+                        default=1)
+    parser.add_argument('--latency',
+                        help="Seconds the fake server adds to each request.",
+                        action="store",
+                        type=float,
+                        default=0.01)
+    parser.add_argument('--error-rate',
+                        help="Fraction of requests the fake server fails.",
+                        action="store",
+                        type=float,
+                        default=0.0)
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def timed_session(latencies, sessions):
+    """Make createTasks' pooled session record each request's latency."""
+    use_session = task_pool.use_session
+
+    def record(response, *args, **kwargs):
+        latencies.append(response.elapsed.total_seconds())
+
+    def timed(pool_size):
+        session = use_session(pool_size)
+        session.hooks['response'].append(record)
+        sessions.append(session)
+        return session
+
+    task_pool.use_session = timed
+    return use_session
+
+
+def run_createTasks(name, argv, fake):
+    """Run createTasks.run() with `argv` and log its throughput."""
+    sys.argv = ['createTasks.py', '-s', fake.url, '-k', 'bench'] + argv
+    options = createTasks.handle_arguments()
+    with open('app.json') as app_json:
+        app_config = json.load(app_json)
+
+    latencies = []
+    sessions = []
+    use_session = timed_session(latencies, sessions)
+    n_log = len(fake.log)
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    start = time.time()
+    failed = None
+    try:
+        createTasks.run(app_config, options)
+    except Exception, err:
+        failed = err
+    finally:
+        wall = time.time() - start
+        sys.stdout.close()
+        sys.stdout = stdout
+        task_pool.use_session = use_session
+        for session in sessions:
+            session.close()
+
+    if failed is not None:
+        logger.error('%s run failed after %.2f s: %r' % (name, wall, failed))
+        return
+
+    log = fake.log[n_log:]
+    n_tasks = sum(1 for method, domain, status, seconds in log
+                  if method in ('POST', 'PUT') and domain == 'task'
+                  and status == 200)
+    n_errors = sum(1 for method, domain, status, seconds in log
+                   if status >= 400)
+    logger.info('%-4s %6d tasks %8.1f tasks/s  p50 %6.1f ms  p99 %6.1f ms  '
+                '%5d requests  %5d failed  %7.2f s wall' % (
+                    name, n_tasks, n_tasks / wall,
+                    1000 * percentile(latencies, 0.50),
+                    1000 * percentile(latencies, 0.99),
+                    len(latencies), n_errors, wall))
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    logging.getLogger('get_emails').setLevel(logging.INFO)
+
+    fake = FakePyBossa(latency=args.latency,
+                       error_rate=args.error_rate,
+                       error_domains=('task', 'taskrun')).start()
+    tmpdir = tempfile.mkdtemp(prefix='bench_createTasks')
+    get_emails.set_root(tmpdir)
+    workers = ['--workers', str(args.workers)]
+    try:
+        inbox = os.path.join(tmpdir, 'INBOX')
+        bench_get_emails.make_maildir(inbox, args.messages)
+        run_createTasks('-c', ['-c'] + workers, fake)
+
+        bench_get_emails.make_maildir(inbox, args.messages,
+                                      first=args.messages)
+        run_createTasks('-x', ['-x'] + workers, fake)
+        run_createTasks('-q', ['-q', '5'] + workers, fake)
+    finally:
+        fake.stop()
+        shutil.rmtree(tmpdir)
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Count files opened and bytes read per message by get_emails().
+
+Builds a throwaway Maildir, then compares the old two-pass ingestion
+(inbox.iteritems() for dates, inbox[key] again for bodies) with the
+header-only scan in get_emails.scan_maildir(), and times a date-ordering
+rescan that can use the persistent MaildirIndex.
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import __builtin__
+import mailbox
+import os
+import shutil
+import sys
+import tempfile
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+import get_emails
+from maildir_index import MaildirIndex
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--messages',
+                        help="Number of messages in the benchmark Maildir.",
+                        action="store",
+                        type=int,
+                        default=2000)
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+class CountingFile(object):
+    """File proxy counting bytes read through it."""
+
+    def __init__(self, fp, counts):
+        self._fp = fp
+        self._counts = counts
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self._counts['bytes'] += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self._fp.readline(*args)
+        self._counts['bytes'] += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._fp.close()
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class count_reads(object):
+    """Count files opened for reading below `root` while active."""
+
+    def __init__(self, root):
+        self.root = root
+        self.counts = {'files': 0, 'bytes': 0}
+
+    def open(self, name, mode='r', *args):
+        fp = self._open(name, mode, *args)
+        if 'r' in mode and os.path.abspath(name).startswith(self.root):
+            self.counts['files'] += 1
+            return CountingFile(fp, self.counts)
+        return fp
+
+    def __enter__(self):
+        self._open = __builtin__.open
+        __builtin__.open = self.open
+        return self.counts
+
+    def __exit__(self, *exc):
+        __builtin__.open = self._open
+
+
+def make_maildir(path, n_messages, first=0):
+    inbox = mailbox.Maildir(path, factory=None, create=True)
+    now = time.time()
+    for i in xrange(first, first + n_messages):
+        message = MIMEMultipart('alternative')
+        message['From'] = 'sender%d@example.com' % (i % 50)
+        message['Subject'] = 'Message %d' % i
+        message['Date'] = formatdate(now - 60 * i)
+        body = u'مرحبا %d\n' % i * 40
+        message.attach(MIMEText(body.encode('utf-8'), 'plain', 'utf-8'))
+        message.attach(MIMEText('<p>%s</p>' % body.encode('utf-8'),
+                                'html', 'utf-8'))
+        inbox.add(message)
+    inbox.close()
+
+
+def two_pass(path):
+    """The ingestion get_emails() used to do, minus the moves."""
+    inbox = mailbox.Maildir(path, factory=None, create=False)
+    date_keys = []
+    for key, msg in inbox.iteritems():
+        date_keys.append((mktime_tz(parsedate_tz(msg['date'])), key))
+    for date_key in sorted(date_keys, key=lambda x: x[0]):
+        get_emails.do_pybossa(inbox[date_key[1]])
+
+
+def header_scan(path):
+    """What get_emails() does now, minus the moves."""
+    for entry in get_emails.scan_maildir(path):
+        get_emails.do_pybossa(entry.message())
+
+
+def rescan(path):
+    """Date ordering only, on a Maildir the index has already seen."""
+    index = MaildirIndex(path + '.index.sqlite')
+    get_emails.scan_maildir(path, index=index)
+    index.close()
+
+
+def run_bench(name, func, path, n_messages):
+    with count_reads(path) as counts:
+        start = time.time()
+        func(path)
+        elapsed = time.time() - start
+    logger.info('%-12s %6.2f files/msg %10.0f bytes/msg %8.2f ms/msg' % (
+        name,
+        counts['files'] / float(n_messages),
+        counts['bytes'] / float(n_messages),
+        1000 * elapsed / n_messages))
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    # Keep per-message debug output out of the timings.
+    logging.getLogger('get_emails').setLevel(logging.INFO)
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_get_emails')
+    try:
+        path = os.path.join(tmpdir, 'INBOX')
+        make_maildir(path, args.messages)
+        logger.info('%d messages in %s' % (args.messages, path))
+        run_bench('two-pass', two_pass, path, args.messages)
+        run_bench('header-scan', header_scan, path, args.messages)
+        rescan(path)
+        run_bench('rescan', rescan, path, args.messages)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Time email ingestion on a synthetic (or given) Maildir corpus.
+
+Runs each stage in its own process so its memory high-water mark can
+be reported:
+
+    scan        get_emails.scan_maildir(), headers only
+    parse       email.message_from_string() per message
+    lean        lean_message.message_from_string() per message
+    body        get_body() per message
+    subject     get_multilingual_subject() per message
+    get_emails  iter_emails() over the whole corpus, journalled so the
+                corpus is left in place.  Its index, journal and
+                Maildirs go to a scratch directory, so nothing is
+                written under --root
+
+Results are saved as JSON under --results so runs can be compared with
+--compare.
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import email
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+from journal import IngestJournal
+from make_corpus import make_corpus
+import get_emails
+import lean_message
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--messages',
+                        help="Size of the synthetic corpus.",
+                        action="store",
+                        type=int,
+                        default=10000)
+    parser.add_argument('--seed',
+                        help="Random seed of the synthetic corpus.",
+                        action="store",
+                        type=int,
+                        default=0)
+    parser.add_argument('--root',
+                        help="Existing directory holding an INBOX Maildir "
+                             "to use instead of a synthetic corpus.",
+                        action="store")
+    parser.add_argument('--results',
+                        help="Directory the JSON results are saved in.",
+                        action="store",
+                        default='bench_results')
+    parser.add_argument('--compare',
+                        help="Earlier results file to compare with.",
+                        action="store")
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(p * (len(values) - 1)))]
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def per_message(func, items):
+    """Call func on each item, returning the list of call times."""
+    times = []
+    for item in items:
+        start = time.time()
+        func(item)
+        times.append(time.time() - start)
+    return times
+
+
+def stage_scan(root):
+    entries = get_emails.scan_maildir(os.path.join(root, 'INBOX'))
+    return len(entries), None
+
+
+def _messages(root):
+    for entry in get_emails.scan_maildir(os.path.join(root, 'INBOX')):
+        yield email.message_from_string(entry.read())
+
+
+def stage_parse(root):
+    entries = get_emails.scan_maildir(os.path.join(root, 'INBOX'))
+    times = per_message(email.message_from_string,
+                        (entry.read() for entry in entries))
+    return len(times), times
+
+
+def stage_lean(root):
+    entries = get_emails.scan_maildir(os.path.join(root, 'INBOX'))
+    times = per_message(lean_message.message_from_string,
+                        (entry.read() for entry in entries))
+    return len(times), times
+
+
+def stage_body(root):
+    times = per_message(get_emails.get_body, _messages(root))
+    return len(times), times
+
+
+def stage_subject(root):
+    times = per_message(get_emails.get_multilingual_subject, _messages(root))
+    return len(times), times
+
+
+def stage_get_emails(root):
+    # INBOX is only read, through a symlink from the scratch root.
+    scratch = tempfile.mkdtemp(prefix='bench_ingest')
+    try:
+        os.symlink(os.path.abspath(os.path.join(root, 'INBOX')),
+                   os.path.join(scratch, 'INBOX'))
+        get_emails.set_root(scratch)
+        journal = IngestJournal(os.path.join(scratch, 'bench.journal'))
+        n = sum(1 for msg in get_emails.iter_emails(journal=journal))
+        journal.close()
+    finally:
+        shutil.rmtree(scratch)
+    return n, None
+
+
+STAGES = [('scan', stage_scan),
+          ('parse', stage_parse),
+          ('lean', stage_lean),
+          ('body', stage_body),
+          ('subject', stage_subject),
+          ('get_emails', stage_get_emails)]
+
+
+def _run_stage(func, root, queue):
+    start = time.time()
+    n, times = func(root)
+    wall = time.time() - start
+    result = dict(messages=n, wall=wall, max_rss_kb=max_rss_kb())
+    if times:
+        result.update(mean_ms=1000 * sum(times) / len(times),
+                      p50_ms=1000 * percentile(times, 0.50),
+                      p99_ms=1000 * percentile(times, 0.99))
+    queue.put(result)
+
+
+def run_stage(func, root):
+    """Run one stage in a fresh process and return its measurements."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_stage,
+                                      args=(func, root, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def compare(results, path):
+    with open(path) as fp:
+        old = json.load(fp)['stages']
+    for name, func in STAGES:
+        if name not in old or name not in results:
+            continue
+        for metric in ('wall', 'p50_ms', 'p99_ms', 'max_rss_kb'):
+            if metric in old[name] and metric in results[name] \
+                    and old[name][metric]:
+                logger.info('%-10s %-10s %10.2f -> %10.2f  (%+.0f%%)' % (
+                    name, metric, old[name][metric], results[name][metric],
+                    100.0 * (float(results[name][metric]) /
+                             old[name][metric] - 1)))
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    logging.getLogger('get_emails').setLevel(logging.INFO)
+
+    tmpdir = None
+    root = args.root
+    if root is None:
+        tmpdir = tempfile.mkdtemp(prefix='bench_ingest')
+        root = tmpdir
+        start = time.time()
+        make_corpus(os.path.join(root, 'INBOX'), args.messages, args.seed)
+        logger.info('%d message corpus built in %.1f s.' % (
+            args.messages, time.time() - start))
+
+    results = {}
+    try:
+        for name, func in STAGES:
+            result = results[name] = run_stage(func, root)
+            logger.info('%-10s %7d msgs %8.2f s wall %8.3f ms/msg '
+                        '%s  max RSS %d MB' % (
+                            name, result['messages'], result['wall'],
+                            1000 * result['wall'] / max(1, result['messages']),
+                            'p50 %.3f ms p99 %.3f ms' % (result['p50_ms'],
+                                                         result['p99_ms'])
+                            if 'p50_ms' in result else ' ' * 27,
+                            result['max_rss_kb'] / 1024))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    if not os.path.isdir(args.results):
+        os.makedirs(args.results)
+    path = os.path.join(args.results, 'ingest-%s.json' % (
+        time.strftime('%Y%m%d-%H%M%S')))
+    with open(path, 'w') as fp:
+        json.dump(dict(messages=args.messages, seed=args.seed,
+                       root=args.root, stages=results), fp, indent=2)
+    logger.info('Results saved to %s' % path)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
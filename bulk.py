@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Task files: pending task_info rows as newline-delimited JSON or CSV.
+
+Each row is a task_info dict plus the 'msg_key' of the message it came
+from.  Rows are written and read back one at a time, so a backlog of
+any size never has to fit in memory.  The CSV columns follow FIELDS;
+non-string values, and every value of JSON_FIELDS, are JSON encoded in
+their cells.
+"""
+
+import csv
+import json
+
+FIELDS = ('msg_key', 'question', 'n_answers', 'msgs_text', 'msgs_html',
+          'msg_subject', 'msg_date', 'msg_attachments', 'msg_id', 'msg_part',
+          'msg_parts', 'priority_0')
+
+# Fields only some tasks have.  Their empty CSV cells are dropped.
+OPTIONAL_FIELDS = ('msg_attachments', 'msg_id', 'msg_part', 'msg_parts',
+                   'priority_0')
+
+# CSV cells decoded back from JSON on reading.  msg_date may be None.
+JSON_FIELDS = ('n_answers', 'msgs_html', 'msg_date', 'msg_attachments',
+               'msg_part', 'msg_parts', 'priority_0')
+
+# A message body can be far longer than the csv module's default limit
+# of 128 KiB a cell.  This also covers export and aggregate files.
+csv.field_size_limit(2 ** 31 - 1)
+
+
+def file_format(path):
+    """'csv' for a .csv file, else 'json' (one JSON object per line)."""
+    return 'csv' if path.lower().endswith('.csv') else 'json'
+
+
+def write_tasks(path, rows):
+    """Write task rows to `path`, returning how many were written."""
+    n = 0
+    with open(path, 'wb') as fp:
+        if file_format(path) == 'csv':
+            writer = csv.writer(fp)
+            writer.writerow(FIELDS)
+            for row in rows:
+                writer.writerow([task_cell(row, field)
+                                 for field in FIELDS])
+                n += 1
+        else:
+            for row in rows:
+                fp.write(json.dumps(row) + '\n')
+                n += 1
+    return n
+
+
+def read_tasks(path):
+    """Yield the task rows in a file written by write_tasks()."""
+    with open(path, 'rb') as fp:
+        if file_format(path) == 'csv':
+            reader = csv.reader(fp)
+            header = next(reader)
+            for cells in reader:
+                row = dict((field, cell.decode('utf-8'))
+                           for field, cell in zip(header, cells))
+                for field in OPTIONAL_FIELDS:
+                    if row.get(field) == '':
+                        del row[field]
+                for field in JSON_FIELDS:
+                    if field in row:
+                        row[field] = json.loads(row[field])
+                yield row
+        else:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def task_cell(row, field):
+    # Optional fields are left empty when missing, and dropped on reading.
+    if field in JSON_FIELDS and field not in OPTIONAL_FIELDS:
+        return json.dumps(row.get(field))
+    return csv_cell(row.get(field))
+
+
+def csv_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
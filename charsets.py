@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Charset name and header decoding with caches.
+
+Mail declares the same few charsets under many names (windows-1256,
+cp1256, "WINDOWS-1256", x-cp1256...), and reply chains repeat the same
+encoded subject over and over.  codec() resolves each spelling once,
+and decode_header_text() skips decode_header() for plain ASCII headers
+and remembers the most recent encoded ones.
+"""
+
+import codecs
+from email.header import decode_header
+
+# Spellings seen in mail that Python's codec registry does not know.
+ALIASES = {
+    'x-cp1256': 'cp1256',
+    'windows-1256-i': 'cp1256',
+    'iso-8859-6-i': 'iso8859-6',
+    'iso-8859-6-e': 'iso8859-6',
+    'iso-8859-8-i': 'iso8859-8',
+    'ks_c_5601-1987': 'cp949',
+    'x-gbk': 'gbk',
+    'x-sjis': 'shift_jis',
+    'x-mac-arabic': 'mac-arabic',
+}
+
+# Encoded headers remembered by decode_header_text().
+HEADER_CACHE_SIZE = 10000
+
+_codecs = {}
+
+
+def codec(charset):
+    """Python codec name for a declared charset, or None if unknown."""
+    try:
+        return _codecs[charset]
+    except KeyError:
+        pass
+    name = str(charset).strip().strip('"\'').lower()
+    name = ALIASES.get(name, name)
+    try:
+        name = codecs.lookup(name).name
+    except LookupError:
+        name = None
+    _codecs[charset] = name
+    return name
+
+
+def decode_text(data, charset, default='ascii'):
+    """Decode bytes in `charset`, or in `default` if it is unknown."""
+    return unicode(data, codec(charset) or codec(default) or 'ascii',
+                   'replace')
+
+
+class LRU(object):
+    """Dictionary keeping roughly the `size` most recently used keys.
+
+    Keys live in a young and an old generation of plain dicts.  A key
+    found in the old one moves to the young one, and when the young one
+    is full it becomes the old one.  Hits are a single dict lookup,
+    which an OrderedDict kept in exact order cannot match in Python 2.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.young = {}
+        self.old = {}
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        value = self.young.get(key)
+        if value is None:
+            value = self.old.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.put(key, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(self.young) >= self.size // 2:
+            self.old, self.young = self.young, {}
+        self.young[key] = value
+
+
+_headers = LRU(HEADER_CACHE_SIZE)
+
+
+def decode_header_text(value, default='ascii'):
+    """Decode an RFC 2047 header to unicode, or None for a missing one."""
+    if value is None:
+        return None
+    if isinstance(value, unicode):
+        return value
+    if '=?' not in value:
+        try:
+            return value.decode('ascii')
+        except UnicodeError:
+            return decode_text(value, default)
+
+    key = (value, default)
+    text = _headers.get(key)
+    if text is None:
+        text = u''.join(decode_text(data, charset or default, default)
+                        for data, charset in decode_header(value))
+        _headers.put(key, text)
+    return text
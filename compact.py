@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Trim message bodies down to the text that needs translating.
+
+compact_text() drops quoted reply history, the attribution line that
+introduces it, everything below a signature delimiter or an "Original
+Message" separator, and repeated whitespace.  split_text() cuts what is
+left into pieces of at most MAX_CHARS characters at paragraph, line or
+word boundaries, one task each.
+"""
+
+import re
+
+# Longest msgs_text of one task, in characters.
+MAX_CHARS = 4000
+
+# "On Mon, 1 Jul 2013, someone wrote:" and the Arabic Gmail form.
+ATTRIBUTION = re.compile(ur'^(on\s.*\swrote:|في\s.*\sكتب.*:)$',
+                         re.IGNORECASE | re.UNICODE)
+
+ORIGINAL_MESSAGE = re.compile(ur'^-{2,}\s*original message\s*-{2,}$',
+                              re.IGNORECASE | re.UNICODE)
+
+SPACES = re.compile(ur'[ \t\u00a0\u200b]+', re.UNICODE)
+
+BLANK_LINES = re.compile(ur'\n{3,}')
+
+
+def compact_text(text):
+    """The body without quoted replies, signature or extra whitespace."""
+    source = text.splitlines()
+    lines = []
+    for i, line in enumerate(source):
+        stripped = line.strip()
+        if stripped.startswith('>'):
+            continue
+        if line.rstrip() == '--' or ORIGINAL_MESSAGE.match(stripped):
+            break
+        if ATTRIBUTION.match(stripped) and _quote_follows(source, i):
+            continue
+        lines.append(SPACES.sub(u' ', stripped))
+    return BLANK_LINES.sub(u'\n\n', u'\n'.join(lines)).strip()
+
+
+def _quote_follows(lines, i):
+    for line in lines[i + 1:]:
+        if line.strip():
+            return line.strip().startswith('>')
+    return True
+
+
+def split_text(text, max_chars=MAX_CHARS):
+    """Cut text into pieces of at most max_chars, or [text] if it fits."""
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+    pieces = []
+    while len(text) > max_chars:
+        cut = -1
+        for separator in (u'\n\n', u'\n', u' '):
+            cut = text.rfind(separator, 0, max_chars + 1)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        pieces.append(text)
+    return pieces
@@ -17,9 +17,36 @@
 # along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+import logging
+import os
+import time
 from optparse import OptionParser
 import pbclient
-from get_emails import get_emails
+import aggregate
+import api_client
+import assets
+import bulk
+import compact
+import early_stop
+import priority
+from attachments import AttachmentStore
+from dedup import DedupIndex
+from export import export_results
+import get_emails
+from get_emails import archive_created
+from get_emails import iter_emails
+from journal import CREATED
+from journal import PARSED
+from journal import IngestJournal
+from rw_io import Bunch
+from rw_io import prefetch
+from rw_io import set_logging
+import stats
+import task_pool
+from watch import watch_maildir
+
+stats_logger = logging.getLogger('stats')
+stats_logger.propagate = False
 
 
 def contents(filename):
@@ -60,6 +87,124 @@ def handle_arguments():
                       help="Add more tasks",
                       metavar="ADD-MORE-TASKS")
 
+    # Keep running, adding tasks as new mail arrives
+    parser.add_option("--watch", action="store_true",
+                      dest="watch",
+                      help="Keep adding tasks for new mail until interrupted "
+                           "(implies -x)")
+
+    parser.add_option("--poll-interval",
+                      type="float",
+                      dest="poll_interval",
+                      help="Seconds between INBOX checks for --watch "
+                           "without pyinotify",
+                      metavar="SECONDS",
+                      default=5.0)
+
+    parser.add_option("--settle",
+                      type="float",
+                      dest="settle",
+                      help="Seconds --watch waits after new mail for more "
+                           "before adding tasks",
+                      metavar="SECONDS",
+                      default=1.0)
+
+    # Stream the new tasks to a file and post them from it
+    parser.add_option("--bulk",
+                      dest="bulk",
+                      help="Write the new tasks to FILE (.csv for CSV, else "
+                           "one JSON object per line) and create them from it",
+                      metavar="FILE")
+
+    parser.add_option("--dry-run", action="store_true",
+                      dest="dry_run",
+                      help="With --bulk, only write the file")
+
+    # Download the tasks and the volunteers' answers
+    parser.add_option("--export-results",
+                      dest="export_results",
+                      help="Write the app's tasks and task runs to FILE (.csv "
+                           "for CSV, else one JSON object per line), resuming "
+                           "an interrupted export",
+                      metavar="FILE")
+
+    # Pick a consensus translation per task
+    parser.add_option("--aggregate",
+                      dest="aggregate",
+                      help="Write each task's consensus translation and its "
+                           "agreement score to FILE (.csv for CSV, else one "
+                           "JSON object per line)",
+                      metavar="FILE")
+
+    parser.add_option("--from-export",
+                      dest="from_export",
+                      help="With --aggregate, read the task runs from a "
+                           "--export-results FILE instead of the server",
+                      metavar="FILE")
+
+    # Lower n_answers on tasks whose translations already agree
+    parser.add_option("--early-stop", action="store_true",
+                      dest="early_stop",
+                      help="Set n_answers to the current number of answers "
+                           "on tasks whose translations agree")
+
+    parser.add_option("--min-answers",
+                      type="int",
+                      dest="min_answers",
+                      help="Answers a task needs before --early-stop scores it",
+                      metavar="N",
+                      default=early_stop.MIN_ANSWERS)
+
+    parser.add_option("--min-agreement",
+                      type="float",
+                      dest="min_agreement",
+                      help="Consensus agreement (0-1) at which --early-stop "
+                           "stops a task",
+                      metavar="AGREEMENT",
+                      default=early_stop.MIN_AGREEMENT)
+
+    parser.add_option("--early-stop-state",
+                      dest="early_stop_state",
+                      help="File --early-stop keeps the answers counted so "
+                           "far in",
+                      metavar="FILE",
+                      default="early_stop.json")
+
+    parser.add_option("--early-stop-interval",
+                      type="float",
+                      dest="early_stop_interval",
+                      help="Repeat --early-stop every SECONDS (default: once)",
+                      metavar="SECONDS",
+                      default=0)
+
+    # Serve fresh and urgent messages first
+    parser.add_option("--priority", action="store_true",
+                      dest="priority",
+                      help="Give tasks a priority and post the highest first")
+
+    parser.add_option("--priority-config",
+                      dest="priority_config",
+                      help="JSON file with the weights, senders, keywords, "
+                           "half_life_hours and length_scale of the priority",
+                      metavar="FILE")
+
+    parser.add_option("--priority-scorer",
+                      dest="priority_scorer",
+                      help="Score messages with FUNCTION of MODULE instead",
+                      metavar="MODULE:FUNCTION")
+
+    parser.add_option("--priority-window",
+                      type="int",
+                      dest="priority_window",
+                      help="Parsed messages reordered by priority",
+                      metavar="N",
+                      default=priority.WINDOW)
+
+    # Ask the server for the number of tasks before and after adding
+    parser.add_option("--count-tasks", action="store_true",
+                      dest="count_tasks",
+                      help="Count the app's tasks on the server at start and end")
+
     # Modify the number of TaskRuns per Task
     # (default 30)
     parser.add_option("-n", "--number-answers",
@@ -69,12 +214,109 @@ def handle_arguments():
                       metavar="N-ANSWERS",
                       default=30)
 
+    # Drop messages whose text and subject were already sent
+    parser.add_option("--no-dedup", action="store_false",
+                      dest="dedup",
+                      help="Create tasks for duplicate messages too",
+                      default=True)
+
+    parser.add_option("--near-duplicates",
+                      type="float",
+                      dest="near_duplicates",
+                      help="Also drop messages this similar (0-1) to a sent one",
+                      metavar="SIMILARITY")
+
+    # Concurrent create_task requests for -c/-x
+    parser.add_option("-w", "--workers",
+                      type="int",
+                      dest="workers",
+                      help="Number of concurrent task requests",
+                      metavar="WORKERS",
+                      default=1)
+
+    # How hard to push the server
+    parser.add_option("--rate",
+                      type="float",
+                      dest="rate",
+                      help="At most RATE requests a second",
+                      metavar="RATE")
+
+    parser.add_option("--burst",
+                      type="int",
+                      dest="burst",
+                      help="Requests sent at once after a pause, with --rate "
+                           "(default: --workers)",
+                      metavar="N")
+
+    parser.add_option("--retries",
+                      type="int",
+                      dest="retries",
+                      help="Retries of a request after 429, 5xx, timeouts "
+                           "and connection errors",
+                      metavar="N",
+                      default=api_client.RETRIES)
+
+    parser.add_option("--target-latency",
+                      type="float",
+                      dest="target_latency",
+                      help="Send fewer requests at once while responses take "
+                           "longer than SECONDS",
+                      metavar="SECONDS")
+
+    # Processes parsing messages for -c/-x
+    parser.add_option("--numcores",
+                      type="int",
+                      dest="numcores",
+                      help="Number of cores parsing email in parallel",
+                      metavar="NUMCORES",
+                      default=1)
+
+    # Parsed messages waiting for task creation while parsing continues
+    parser.add_option("-b", "--buffer",
+                      type="int",
+                      dest="buffer",
+                      help="Messages parsed ahead of task creation",
+                      metavar="BUFFER",
+                      default=100)
+
+    # Task payload size
+    parser.add_option("--full-bodies", action="store_false",
+                      dest="compact",
+                      help="Keep quoted replies, signatures and whitespace "
+                           "in message bodies",
+                      default=True)
+
+    parser.add_option("--max-chars",
+                      type="int",
+                      dest="max_chars",
+                      help="Split longer bodies into several tasks "
+                           "(0 never splits)",
+                      metavar="CHARS",
+                      default=compact.MAX_CHARS)
+
+    # Save attachments by content hash and reference them in tasks
+    parser.add_option("--attachments", action="store_true",
+                      dest="attachments",
+                      help="Store attachments in SyriaSpeakingGmail/ATTACHMENTS "
+                           "and list them in the tasks")
+
+    parser.add_option("--attachments-url",
+                      dest="attachments_url",
+                      help="URL the ATTACHMENTS directory is served at, for "
+                           "the presenter to link to",
+                      metavar="URL")
+
     parser.add_option("-a", "--application-config",
                       dest="app_config",
                       help="Application config file",
                       metavar="APP-CONFIG",
                       default="app.json")
 
+    parser.add_option("--minify", action="store_true",
+                      dest="minify",
+                      help="Strip comments and indentation from the HTML "
+                           "uploaded by -c and -t")
+
     parser.add_option("--user",
                       dest="user",
                       help="HTTP User")
@@ -83,11 +325,41 @@ def handle_arguments():
                       dest="password",
                       help="HTTP Password")
 
+    # Per-stage timings and counters, logged at exit
+    parser.add_option("--stats",
+                      type="choice",
+                      choices=["json", "prometheus"],
+                      dest="stats",
+                      help="Log stage timings and counters at exit as json "
+                           "or prometheus text",
+                      metavar="FORMAT")
+
+    parser.add_option("--flog", action="store_true",
+                      dest="flog",
+                      help="Also write the --stats output to createTasks.py.log")
+
     parser.add_option("-v", "--verbose", action="store_true", dest="verbose")
     (options, args) = parser.parse_args()
 
+    if options.dry_run and not options.bulk:
+        parser.error("--dry-run needs --bulk FILE")
+
+    if options.from_export and not options.aggregate:
+        parser.error("--from-export needs --aggregate FILE")
+
+    if (options.aggregate or options.early_stop) and not aggregate.NUMPY:
+        parser.error("--aggregate and --early-stop need numpy")
+
+    if options.priority_config or options.priority_scorer:
+        options.priority = True
+
+    if options.watch and not options.create_app:
+        options.add_more_tasks = True
+
     if not options.create_app and not options.update_template\
-            and not options.add_more_tasks and not options.update_tasks:
+            and not options.add_more_tasks and not options.update_tasks\
+            and not options.export_results and not options.aggregate\
+            and not options.early_stop:
         parser.error("Please check --help or -h for the available options")
 
     if not options.api_key:
@@ -110,51 +382,334 @@ def get_configuration():
 
     return (app_config, options)
 
+def set_stats_logging(options):
+    set_logging(stats_logger, Bunch(quiet=False,
+                                    verbose=False,
+                                    qc=False,
+                                    vc=False,
+                                    nolog=not options.stats,
+                                    flog=options.flog,
+                                    floglevel='INFO',
+                                    colorlog=False,
+                                    loglevel='INFO'))
+
 def run(app_config, options):
     def find_app_by_short_name():
         return pbclient.find_app(short_name=app_config['short_name'])[0]
 
-    def setup_app():
-        app = find_app_by_short_name()
-        app.long_description = contents('long_description.html')
-        app.info['task_presenter'] = contents('template.html')
-        app.info['thumbnail'] = app_config['thumbnail']
-        app.info['tutorial'] = contents('tutorial.html')
+    def setup_app(new_app_id=None):
+        # Only the fields that changed since the upload recorded in the
+        # manifest are sent, and nothing at all if none did.
+        manifest = assets.Manifest(
+            os.path.splitext(options.app_config)[0] + '.manifest.json',
+            options.api_url, app_config['short_name'])
+        if new_app_id is not None:
+            manifest.reset()
+            manifest.app_id = new_app_id
+        fields = assets.app_fields(app_config, options.minify)
+        changed = manifest.changed(fields)
+        if not changed and manifest.app_id is not None:
+            print "App assets unchanged, nothing to upload"
+            return pbclient.App(dict(id=manifest.app_id,
+                                     short_name=app_config['short_name']))
+
+        # The cached id saves the search by short name.  The app is
+        # still fetched: PyBossa replaces info as a whole, so changed
+        # info fields go back merged into the current info.
+        app = None
+        if manifest.app_id is not None:
+            data = pbclient._pybossa_req('get', 'app', manifest.app_id)
+            if not task_pool.failed(data):
+                app = pbclient.App(data)
+        if app is None:
+            app = find_app_by_short_name()
 
-        pbclient.update_app(app)
+        payload = dict((field, fields[field]) for field in changed
+                       if field not in assets.INFO_FIELDS)
+        if changed.intersection(assets.INFO_FIELDS):
+            for field in changed.intersection(assets.INFO_FIELDS):
+                app.info[field] = fields[field]
+            payload['info'] = app.info
+        ret = pbclient._pybossa_req('put', 'app', app.id, payload=payload)
+        if task_pool.failed(ret):
+            print "FAILED to update the app (%s)" % ret
+        else:
+            print "Uploaded %s" % ', '.join(sorted(changed))
+            manifest.save(app.id, fields)
         return app
 
-    def create_msg_task(app, msg, question):
+    def iter_tasks(app):
+        offset = 0
+        limit = 100
+        while True:
+            with stats.timer('get_tasks'):
+                # A failed request raises TypeError, counted by the
+                # timer: pbclient gets a status code instead of a list.
+                tasks = pbclient.get_tasks(app.id, offset=offset, limit=limit)
+            if len(tasks) == 0:
+                break
+            for task in tasks:
+                yield task
+            offset += len(tasks)
+
+    def count_tasks(app):
+        return sum(1 for task in iter_tasks(app))
+
+    def msg_task_infos(msg, question):
         # Data for the tasks
         # msgs_text and msgs_html are lists, hence 'msgs' not 'msg'.
         # msg_subject and msg_date are simple strings.
-        task_info = dict(question=question,
-                         n_answers=options.n_answers,
-                         msgs_text=msg['msgs_text'],
-                         msgs_html=msg['msgs_html'],
-                         msg_subject=msg['msg_subject'],
-                         msg_date=msg['msg_date'])
-
-        print task_info['msg_subject']
-        print len(pbclient.get_tasks(app.id))
-
+        # A body over --max-chars is split into several tasks, linked by
+        # msg_id and numbered by msg_part of msg_parts.
+        pieces = compact.split_text(msg['msgs_text'], options.max_chars)
+        infos = []
+        for i, text in enumerate(pieces):
+            task_info = dict(question=question,
+                             n_answers=options.n_answers,
+                             msgs_text=text,
+                             msgs_html=msg['msgs_html'],
+                             msg_subject=msg['msg_subject'],
+                             msg_date=msg['msg_date'])
+            if len(pieces) > 1:
+                task_info.update(msg_id=msg['msg_key'], msg_part=i + 1,
+                                 msg_parts=len(pieces))
+            # References only: the presenter fetches attachments itself.
+            if msg.get('msg_attachments'):
+                task_info['msg_attachments'] = msg['msg_attachments']
+            infos.append(task_info)
+        return infos
+
+    def create_task_info(app, task_info, priority_0=None):
         # from erpy.ipshell import ipshell
         # ipshell('here')
         # sys.exit()
         # return
 
-        pbclient.create_task(app.id, task_info)
+        with stats.timer('create_msg_task'):
+            if priority_0 is None:
+                task = pbclient.create_task(app.id, task_info)
+            else:
+                task = priority.create_task(app.id, task_info, priority_0)
+        if task_pool.failed(task):
+            stats.error('create_msg_task')
+        return task
+
+    def report_sizes(sizes, n_tasks):
+        stats.incr('body_chars', sizes['body'])
+        stats.incr('body_chars_sent', sizes['text'])
+        stats.incr('payload_bytes', sizes['payload'])
+        if not n_tasks:
+            return
+        print "Message bodies: %s characters, %s after trimming (%d%%)." % (
+            sizes['body'], sizes['text'],
+            100.0 * sizes['text'] / max(1, sizes['body']))
+        print "Task payloads: %s bytes, %s per task." % (
+            sizes['payload'], sizes['payload'] / n_tasks)
 
     def add_msg_tasks(app):
-        # First of all we get the emails.
-        # Then, we have to create a set of tasks for the application
-        # For this, we get first the email messages from local offlineimap dir.
-        msgs = get_emails()
+        # The email messages come from the local offlineimap dir.  They
+        # are parsed in the background while tasks are created, at most
+        # options.buffer messages ahead.  With --workers the tasks are
+        # created concurrently but reported in message order.
         question = app_config['question']
-        [create_msg_task(app, m, question) for m in msgs]
+        # The journal and dedup index live next to INBOX: without it
+        # there is nothing to do and nowhere to put them.
+        if not os.path.isdir(get_emails.INBOX):
+            get_emails.logger.critical(
+                "You must run 'offlineimap.py' to sync email.")
+            return
+        if options.count_tasks:
+            n_before = count_tasks(app)
+            print "%s Tasks on the server" % n_before
+
+        # The journal records each message's task id, so a run that was
+        # interrupted resumes without posting any message twice.
+        # Messages only leave INBOX once their task exists.
+        journal = IngestJournal(get_emails.INBOX_JOURNAL)
+        n_archived = archive_created(journal)
+        if n_archived:
+            print "%s messages from an earlier run archived." % n_archived
+
+        # Duplicates are journalled under the task of the message they
+        # repeat, so they are archived without a task of their own.  A
+        # duplicate of a message posted by this run, or of a split one
+        # with only some of its parts posted, waits for its original: it
+        # is created with it, or stays parsed if the original fails.
+        dedup = None
+        if options.dedup:
+            dedup = DedupIndex(get_emails.DEDUP_INDEX,
+                               options.near_duplicates)
+        posting = set()
+        waiting = {}
+
+        def unique(msgs):
+            for m in msgs:
+                original = dedup.check(m, m['msg_key'])
+                if original is None:
+                    posting.add(m['msg_key'])
+                    yield m
+                    continue
+                print "Duplicate of %s dropped: %s" % (original,
+                                                       m['msg_subject'])
+                stats.incr('duplicates_dropped')
+                if options.dry_run:
+                    continue
+                if original in posting or journal.state(original) == PARSED:
+                    waiting.setdefault(original, []).append(m['msg_key'])
+                else:
+                    journal.record(m['msg_key'], CREATED,
+                                   journal.task_id(original))
+
+        def created(key, task_id):
+            posting.discard(key)
+            journal.record(key, CREATED, task_id)
+            for duplicate in waiting.pop(key, []):
+                journal.record(duplicate, CREATED, task_id)
+
+        def not_created(key):
+            posting.discard(key)
+            if journal.posted_parts(key):
+                # Some parts have tasks, so no copy may be posted in
+                # full: the original keeps its fingerprint, and the
+                # duplicates stay parsed and wait for it on the next run.
+                waiting.pop(key, None)
+                return
+            for k in [key] + waiting.pop(key, []):
+                journal.record(k, PARSED)
+                if dedup is not None:
+                    dedup.release(k)
+
+        # Body and payload sizes, in characters and JSON bytes.
+        sizes = dict(body=0, text=0, payload=0)
+
+        def task_rows(msgs, keys):
+            for m in msgs:
+                keys.append(m['msg_key'])
+                sizes['body'] += m.get('msgs_text_chars',
+                                       len(m['msgs_text']))
+                sizes['text'] += len(m['msgs_text'])
+                # Parts posted by an interrupted run are not posted again.
+                posted = journal.posted_parts(m['msg_key'])
+                for row in msg_task_infos(m, question):
+                    if row.get('msg_part') in posted:
+                        continue
+                    sizes['payload'] += len(json.dumps(row))
+                    row['msg_key'] = m['msg_key']
+                    if 'priority_0' in m:
+                        row['priority_0'] = m['priority_0']
+                    yield row
+
+        def create_row(row):
+            return create_task_info(app, dict((k, v)
+                                              for k, v in row.iteritems()
+                                              if k not in ('msg_key',
+                                                           'priority_0')),
+                                    row.get('priority_0'))
+
+        # Messages are scored as they are parsed, and the best of the
+        # --priority-window parsed so far is posted next.
+        scorer = None
+        if options.priority_scorer:
+            scorer = priority.load_scorer(options.priority_scorer)
+        elif options.priority_config:
+            scorer = priority.Scorer(json.loads(
+                contents(options.priority_config)))
+        elif options.priority:
+            scorer = priority.Scorer()
+
+        store = None
+        if options.attachments:
+            store = AttachmentStore(get_emails.ATTACHMENTS_DIR,
+                                    options.attachments_url)
+
+        # Progress is counted here rather than asked of the server, so
+        # each task costs a single request.
+        n_tasks = [0, 0]
+        msgs = prefetch(iter_emails(options.numcores, journal=journal,
+                                    store=store, compact=options.compact),
+                        options.buffer)
+        if scorer is not None:
+            msgs = priority.by_priority(msgs, scorer, options.priority_window)
+        if dedup is not None:
+            msgs = unique(msgs)
+        keys = []
+        rows = task_rows(msgs, keys)
+
+        # PyBossa has no API for importing many tasks in one request, so
+        # --bulk posts the file's rows through the same worker pool.
+        if options.bulk:
+            with stats.timer('write_bulk'):
+                n_rows = bulk.write_tasks(options.bulk, rows)
+            print "%s Tasks written to %s" % (n_rows, options.bulk)
+            report_sizes(sizes, n_rows)
+            if options.dry_run:
+                if dedup is not None:
+                    for key in keys:
+                        dedup.release(key)
+                    dedup.close()
+                journal.close()
+                return
+            rows = bulk.read_tasks(options.bulk)
+
+        # A message whose body was split is only journalled as created
+        # once all its tasks are, under the task of its first part.
+        # Until then each part is journalled with its task id, so if one
+        # fails, or the run stops half way, the next run posts only the
+        # parts that are missing.  Failed messages are settled at the
+        # end, once the results of all their parts are known.
+        failed = set()
+        try:
+            for i, (m, task, err) in enumerate(
+                    task_pool.imap(create_row, rows, options.workers)):
+                if err is not None or task_pool.failed(task):
+                    n_tasks[1] += 1
+                    stats.incr('tasks_failed')
+                    print "%s FAILED (%s): %s" % (i + 1, err or task,
+                                                   m['msg_subject'])
+                    failed.add(m['msg_key'])
+                else:
+                    task_id = task['id']
+                    if m.get('msg_parts'):
+                        parts = journal.record_part(m['msg_key'],
+                                                    m['msg_part'], task_id)
+                        task_id = None
+                        if len(parts) >= m['msg_parts']:
+                            task_id = parts[min(parts)]
+                    if task_id is not None and m['msg_key'] not in failed:
+                        created(m['msg_key'], task_id)
+                    n_tasks[0] += 1
+                    stats.incr('tasks_created')
+                    print "%s Task %s: %s" % (i + 1, task['id'],
+                                              m['msg_subject'])
+        finally:
+            for key in failed:
+                not_created(key)
+            archive_created(journal)
+            journal.close()
+            if dedup is not None:
+                dedup.close()
+        print "%s Tasks have been created!" % n_tasks[0]
+        if n_tasks[1]:
+            print "%s Tasks could not be created." % n_tasks[1]
+        if not options.bulk:
+            report_sizes(sizes, sum(n_tasks))
+        if dedup is not None and dedup.n_exact + dedup.n_near:
+            n_saved = dedup.n_exact + dedup.n_near
+            print "%s exact and %s near duplicates dropped, saving %s Tasks " \
+                  "and %s answers." % (dedup.n_exact, dedup.n_near, n_saved,
+                                       n_saved * options.n_answers)
+
+        if options.count_tasks:
+            n_after = count_tasks(app)
+            print "%s Tasks on the server (%s new)" % (n_after,
+                                                       n_after - n_before)
 
     pbclient.set('api_key', options.api_key)
     pbclient.set('endpoint', options.api_url)
+    # Requests are rate limited and retried, and sent by at most
+    # --workers threads at once, fewer while the server is slow.
+    api_client.install(options.workers, options.rate, options.burst,
+                       options.retries, options.target_latency)
 
     if options.verbose:
         print('Running against PyBosssa instance at: %s' % options.api_url)
@@ -162,14 +717,29 @@ def run(app_config, options):
 
     if options.create_app or options.add_more_tasks:
         if options.create_app:
-            pbclient.create_app(app_config['name'],
-                                app_config['short_name'],
-                                app_config['description'])
+            created = pbclient.create_app(app_config['name'],
+                                          app_config['short_name'],
+                                          app_config['description'])
 
-            app = setup_app()
+            # A new app has none of the assets the manifest lists.
+            app = setup_app(created.get('id') if isinstance(created, dict)
+                            else None)
         else:
             app = find_app_by_short_name()
-        add_msg_tasks(app)
+
+        if options.watch:
+            # Each wakeup only opens files new since the last one: the
+            # Maildir index and the journal cover the rest.
+            print "Watching %s for new mail. ^C to stop." % get_emails.INBOX
+            try:
+                for changed in watch_maildir(get_emails.INBOX,
+                                             options.poll_interval,
+                                             options.settle):
+                    add_msg_tasks(app)
+            except KeyboardInterrupt:
+                print "Stopped watching."
+        else:
+            add_msg_tasks(app)
 
     if options.update_template:
         print "Updating app template"
@@ -177,32 +747,103 @@ def run(app_config, options):
         setup_app()
 
     if options.update_tasks:
-        def tasks(app):
-            offset = 0
-            limit = 100
-            while True:
-                tasks = pbclient.get_tasks(app.id, offset=offset, limit=limit)
-                if len(tasks) == 0:
-                    break
-                for task in tasks:
-                    yield task
-                offset += len(tasks)
+        def needs_update(task):
+            return (task.data.get('n_answers') != options.update_tasks
+                    or 'n_answers' in task.info)
 
-        def update_task(task, count):
-            print "Updating task: %s" % task.id
+        def update_task(task):
             if 'n_answers' in task.info:
                 del(task.info['n_answers'])
             task.n_answers = options.update_tasks
-            pbclient.update_task(task)
-            count[0] += 1
+            with stats.timer('update_task'):
+                ret = pbclient.update_task(task)
+            if task_pool.failed(ret):
+                stats.error('update_task')
+            return ret
+
+        def stale_tasks(tasks, count):
+            for task in tasks:
+                if needs_update(task):
+                    yield task
+                else:
+                    count['skipped'] += 1
+                    stats.incr('tasks_update_skipped')
 
         print "Updating task n_answers"
         app = find_app_by_short_name()
 
-        n_tasks = [0]
-        [update_task(t, n_tasks) for t in tasks(app)]
-        print "%s Tasks have been updated!" % n_tasks[0]
+        # The next page of tasks is fetched in the background while the
+        # current one is updated by --workers threads.  Tasks that
+        # already have the requested n_answers are skipped.
+        n_tasks = dict(updated=0, skipped=0, failed=0)
+        tasks = stale_tasks(prefetch(iter_tasks(app), 100), n_tasks)
+        for t, ret, err in task_pool.imap(update_task, tasks, options.workers):
+            if err is not None or task_pool.failed(ret):
+                n_tasks['failed'] += 1
+                stats.incr('tasks_update_failed')
+                print "FAILED to update task %s (%s)" % (t.id, err or ret)
+            else:
+                n_tasks['updated'] += 1
+                stats.incr('tasks_updated')
+                print "Updated task: %s" % t.id
+        print "%s Tasks have been updated!" % n_tasks['updated']
+        print "%s Tasks already had n_answers = %s." % (n_tasks['skipped'],
+                                                        options.update_tasks)
+        if n_tasks['failed']:
+            print "%s Tasks could not be updated." % n_tasks['failed']
+
+    if options.export_results:
+        print "Exporting results to %s" % options.export_results
+        app = find_app_by_short_name()
+        # Pages are fetched by --workers threads ahead of the writer.
+        counts = export_results(options.export_results, app.id,
+                                options.workers)
+        print "%s Tasks and %s Task runs exported." % (counts['task'],
+                                                       counts['taskrun'])
+
+    if options.aggregate:
+        print "Aggregating answers to %s" % options.aggregate
+        if options.from_export:
+            taskruns = aggregate.exported_taskruns(options.from_export)
+        else:
+            app = find_app_by_short_name()
+            taskruns = aggregate.server_taskruns(app.id, options.workers)
+        # The runs are spooled next to the output, not to a /tmp that
+        # may be held in memory.
+        tasks = aggregate.group_taskruns(
+            taskruns, os.path.dirname(os.path.abspath(options.aggregate)))
+        n = aggregate.write_consensus(options.aggregate,
+                                      aggregate.consensus(tasks))
+        print "%s Tasks aggregated." % n
+
+    if options.early_stop:
+        app = find_app_by_short_name()
+        stopper = early_stop.EarlyStopper(app.id, options.early_stop_state,
+                                          options.min_answers,
+                                          options.min_agreement,
+                                          options.workers)
+        # Each pass only reads the task runs added since the last one.
+        try:
+            while True:
+                try:
+                    counts = stopper.run_pass()
+                except IOError, e:
+                    print "FAILED to read new answers (%s)" % e
+                else:
+                    print ("%(runs)s new answers, %(scored)s Tasks scored, "
+                           "%(stopped)s stopped early, %(failed)s failed."
+                           % counts)
+                if not options.early_stop_interval:
+                    break
+                time.sleep(options.early_stop_interval)
+        except KeyboardInterrupt:
+            print "Stopped early stopping."
 
 if __name__ == "__main__":
     app_config, options = get_configuration()
-    run(app_config, options)
+    set_stats_logging(options)
+    try:
+        run(app_config, options)
+    finally:
+        if options.stats:
+            stats.STATS.report(stats_logger, options.stats)
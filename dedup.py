@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent index of message contents already sent to PyBossa.
+
+Forwarded and re-sent emails would otherwise each become a task of
+their own.  Messages are compared on their normalized subject and text:
+an exact match of the SHA-1 digest is always a duplicate, and with a
+near-duplicate threshold, MinHash signatures of word shingles are
+compared through LSH bands so only a handful of candidates are checked.
+"""
+
+import hashlib
+import random
+import re
+import sqlite3
+import zlib
+
+# MinHash permutations, and how they are grouped into LSH bands.
+N_PERMUTATIONS = 64
+N_BANDS = 16
+ROWS_PER_BAND = N_PERMUTATIONS / N_BANDS
+
+# Words per shingle.
+SHINGLE_SIZE = 3
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20130501)
+_PERMUTATIONS = [(_random.randint(1, _PRIME - 1), _random.randint(0, _PRIME - 1))
+                 for i in xrange(N_PERMUTATIONS)]
+
+_NON_WORD = re.compile(r'\W+', re.UNICODE)
+_QUOTE = re.compile(r'^\s*>.*$', re.MULTILINE)
+
+
+def normalize(text):
+    """Lower case words of `text`, without quoted lines or punctuation."""
+    if isinstance(text, (list, tuple)):
+        text = u'\n'.join(text)
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    text = _QUOTE.sub(u' ', text or u'')
+    return _NON_WORD.sub(u' ', text).lower().split()
+
+
+def digest(words):
+    return hashlib.sha1(u' '.join(words).encode('utf-8')).hexdigest()
+
+
+def signature(words):
+    """MinHash signature of the word shingles in `words`."""
+    shingles = set(u' '.join(words[i:i + SHINGLE_SIZE])
+                   for i in xrange(max(1, len(words) - SHINGLE_SIZE + 1)))
+    hashes = [zlib.crc32(s.encode('utf-8')) & 0xffffffff for s in shingles]
+    return [min((a * h + b) % _PRIME for h in hashes)
+            for a, b in _PERMUTATIONS]
+
+
+def similarity(sig1, sig2):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for a, b in zip(sig1, sig2) if a == b) / float(len(sig1))
+
+
+def bands(sig):
+    for i in xrange(N_BANDS):
+        rows = sig[i * ROWS_PER_BAND:(i + 1) * ROWS_PER_BAND]
+        yield '%d:%s' % (i, hashlib.sha1(repr(rows)).hexdigest()[:16])
+
+
+class DedupIndex(object):
+    """Digests and signatures of messages, keyed by Maildir key.
+
+    check() reserves a message's fingerprint straight away so identical
+    messages in flight at the same time are caught; release() forgets
+    it again if its task could not be created.
+    """
+
+    def __init__(self, path, near_threshold=None):
+        self.near_threshold = near_threshold
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS exact (
+                digest TEXT PRIMARY KEY, key TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS signatures (
+                key TEXT PRIMARY KEY, sig TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS bands (
+                band TEXT NOT NULL, key TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS bands_band ON bands (band);
+            ''')
+        self.n_exact = 0
+        self.n_near = 0
+
+    def check(self, msg, key):
+        """Return the key of a message `msg` duplicates, else None.
+
+        A message that is not a duplicate is added to the index.
+        """
+        words = normalize(msg.get('msg_subject')) + normalize(msg['msgs_text'])
+        msg_digest = digest(words)
+        row = self.db.execute('SELECT key FROM exact WHERE digest = ?',
+                              (msg_digest,)).fetchone()
+        if row is not None and row[0] != key:
+            self.n_exact += 1
+            return row[0]
+
+        sig = None
+        if self.near_threshold is not None:
+            sig = signature(words)
+            match = self._near(sig, key)
+            if match is not None:
+                self.n_near += 1
+                return match
+
+        self.db.execute('INSERT OR REPLACE INTO exact VALUES (?, ?)',
+                        (msg_digest, key))
+        if sig is not None:
+            self.db.execute('INSERT OR REPLACE INTO signatures VALUES (?, ?)',
+                            (key, ','.join(map(str, sig))))
+            self.db.executemany('INSERT INTO bands VALUES (?, ?)',
+                                [(band, key) for band in bands(sig)])
+        return None
+
+    def _near(self, sig, key):
+        candidates = set()
+        for band in bands(sig):
+            candidates.update(row[0] for row in self.db.execute(
+                'SELECT key FROM bands WHERE band = ?', (band,)))
+        candidates.discard(key)
+        for candidate in candidates:
+            row = self.db.execute('SELECT sig FROM signatures WHERE key = ?',
+                                  (candidate,)).fetchone()
+            other = [long(x) for x in row[0].split(',')]
+            if similarity(sig, other) >= self.near_threshold:
+                return candidate
+        return None
+
+    def release(self, key):
+        """Forget the message with Maildir key `key`."""
+        self.db.execute('DELETE FROM exact WHERE key = ?', (key,))
+        self.db.execute('DELETE FROM signatures WHERE key = ?', (key,))
+        self.db.execute('DELETE FROM bands WHERE key = ?', (key,))
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Stop asking for answers once a task's translations agree.
+
+Each pass reads only the task runs added since the previous one (the
+task run offset is kept in the state file) and rescores the tasks they
+belong to, fetching those tasks' runs.  A task with at least
+min_answers answers whose consensus agreement (see aggregate.py)
+reaches min_agreement gets n_answers lowered to its current number of
+runs, so PyBossa considers it complete and serves the contested tasks
+instead.
+
+The state file is JSON:
+
+    taskrun_offset  task runs already counted
+    runs            task id -> number of runs counted
+    pending         tasks to rescore, whose last pass failed
+    stopped         tasks whose n_answers was lowered
+"""
+
+import pbclient
+import stats
+import task_pool
+from aggregate import answer_text
+from aggregate import consensus
+from export import PAGE_SIZE
+from export import iter_pages
+from export import load_checkpoint
+from export import save_checkpoint
+
+MIN_ANSWERS = 5
+
+MIN_AGREEMENT = 0.8
+
+
+class EarlyStopper(object):
+
+    def __init__(self, app_id, path, min_answers=MIN_ANSWERS,
+                 min_agreement=MIN_AGREEMENT, workers=1):
+        self.app_id = app_id
+        self.path = path
+        self.min_answers = min_answers
+        self.min_agreement = min_agreement
+        self.workers = workers
+        state = load_checkpoint(path) or {}
+        self.taskrun_offset = state.get('taskrun_offset', 0)
+        # JSON object keys are strings.
+        self.runs = dict((int(task_id), n) for task_id, n
+                         in state.get('runs', {}).iteritems())
+        self.pending = set(state.get('pending', []))
+        self.stopped = set(state.get('stopped', []))
+
+    def save(self):
+        save_checkpoint(self.path, dict(taskrun_offset=self.taskrun_offset,
+                                        runs=self.runs,
+                                        pending=sorted(self.pending),
+                                        stopped=sorted(self.stopped)))
+
+    def count_new_runs(self):
+        """Count the task runs added since the last pass.
+
+        The tasks they belong to are added to self.pending page by
+        page, so a failed page loses nothing counted before it.
+        """
+        for offset, taskruns in iter_pages('taskrun', self.app_id,
+                                           self.taskrun_offset, self.workers):
+            for taskrun in taskruns:
+                task_id = taskrun.task_id
+                self.runs[task_id] = self.runs.get(task_id, 0) + 1
+                self.pending.add(task_id)
+            self.taskrun_offset = offset + len(taskruns)
+            stats.incr('early_stop_new_runs', len(taskruns))
+
+    def task_runs(self, task_id):
+        """(taskrun_id, answer text) for each run of the task."""
+        runs = []
+        offset = 0
+        while True:
+            # pbclient.find_taskruns() queries the task domain.
+            with stats.timer('get_taskruns'):
+                page = pbclient._pybossa_req('get', 'taskrun', params=dict(
+                    task_id=task_id, limit=PAGE_SIZE, offset=offset))
+            if task_pool.failed(page):
+                stats.error('get_taskruns')
+                raise IOError('Could not get the runs of task %s: %s' % (
+                    task_id, page))
+            runs.extend((taskrun['id'], answer_text(taskrun.get('info')))
+                        for taskrun in page)
+            if len(page) < PAGE_SIZE:
+                return runs
+            offset += PAGE_SIZE
+
+    def stop(self, task_id, n_runs):
+        """Lower the task's n_answers to n_runs.  False on failure."""
+        with stats.timer('get_task'):
+            data = pbclient._pybossa_req('get', 'task', task_id)
+        if task_pool.failed(data):
+            stats.error('get_task')
+            return False
+        task = pbclient.Task(data)
+        if task.n_answers <= n_runs:
+            return True
+        task.n_answers = n_runs
+        with stats.timer('update_task'):
+            ret = pbclient.update_task(task)
+        if task_pool.failed(ret):
+            stats.error('update_task')
+            return False
+        return True
+
+    def run_pass(self):
+        """Rescore the tasks with new runs and stop the converged ones.
+
+        Returns counts of new runs, scored, stopped and failed tasks.
+        """
+        counts = dict(runs=0, scored=0, stopped=0, failed=0)
+        before = self.taskrun_offset
+        try:
+            self.count_new_runs()
+        except IOError:
+            self.save()
+            raise
+        counts['runs'] = self.taskrun_offset - before
+        candidates = sorted(task_id for task_id in self.pending - self.stopped
+                            if self.runs.get(task_id, 0) >= self.min_answers)
+        self.pending = set()
+
+        def fetched(task_ids):
+            for task_id, runs, err in task_pool.imap(self.task_runs, task_ids,
+                                                     self.workers):
+                if err is not None:
+                    counts['failed'] += 1
+                    self.pending.add(task_id)
+                else:
+                    yield task_id, runs
+
+        converged = []
+        for result in consensus(fetched(candidates)):
+            counts['scored'] += 1
+            if (result['n_answers'] >= self.min_answers
+                    and result['agreement'] >= self.min_agreement):
+                converged.append((result['task_id'], result['n_runs']))
+
+        for (task_id, n_runs), ok, err in task_pool.imap(
+                lambda args: self.stop(*args), converged, self.workers):
+            if ok and err is None:
+                counts['stopped'] += 1
+                self.stopped.add(task_id)
+                stats.incr('early_stopped_tasks')
+            else:
+                counts['failed'] += 1
+                self.pending.add(task_id)
+        self.save()
+        return counts
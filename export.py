@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Export an app's tasks and task runs page by page, resumably.
+
+Tasks and then task runs are written to one file, a row per object:
+one JSON object per line, or CSV when the file name ends in .csv (the
+info column then holds JSON).  Pages are fetched ahead of the writer by
+a pool of threads, and only those pages are in memory at once.
+
+After every page the file is flushed and FILE.checkpoint records how
+far the export got.  Running the export again resumes from there; the
+checkpoint is removed once the export is complete.
+"""
+
+import csv
+import itertools
+import json
+import os
+
+import pbclient
+import stats
+import task_pool
+from bulk import csv_cell
+from bulk import file_format
+
+DOMAINS = ('task', 'taskrun')
+
+FIELDS = ('domain', 'id', 'task_id', 'user_id', 'created', 'finish_time',
+          'n_answers', 'info')
+
+# Objects per request.
+PAGE_SIZE = 100
+
+def iter_pages(domain, app_id, offset=0, workers=1, limit=PAGE_SIZE):
+    """Yield (offset, objects) for each page from `offset` on.
+
+    With several workers the following pages are requested while the
+    current one is being written.  The first empty page ends the export.
+    """
+    def fetch(offset):
+        with stats.timer('get_%ss' % domain):
+            return getattr(pbclient, 'get_%ss' % domain)(app_id, limit=limit,
+                                                         offset=offset)
+
+    pages = task_pool.imap(fetch, itertools.count(offset, limit), workers)
+    try:
+        for offset, objects, err in pages:
+            if err is not None:
+                # pbclient fails on the status code it got instead of a list.
+                stats.error('get_%ss' % domain)
+                raise IOError('Could not get %ss at offset %s: %r' % (
+                    domain, offset, err))
+            if not objects:
+                break
+            yield offset, objects
+    finally:
+        pages.close()
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except IOError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(checkpoint, fp)
+    os.rename(path + '.tmp', path)
+
+
+def export_results(path, app_id, workers=1):
+    """Write the app's tasks and task runs to `path`.
+
+    Returns the number of objects written by this call for each domain.
+    """
+    checkpoint_path = path + '.checkpoint'
+    checkpoint = load_checkpoint(checkpoint_path)
+    csv_file = file_format(path) == 'csv'
+
+    if checkpoint is None:
+        fp = open(path, 'wb')
+        if csv_file:
+            csv.writer(fp).writerow(FIELDS)
+        checkpoint = dict(domain=DOMAINS[0], offset=0, bytes=fp.tell())
+    else:
+        # Drop whatever was written after the last checkpoint.
+        fp = open(path, 'r+b')
+        fp.truncate(checkpoint['bytes'])
+        fp.seek(checkpoint['bytes'])
+
+    writer = csv.writer(fp) if csv_file else None
+    counts = dict((domain, 0) for domain in DOMAINS)
+    try:
+        for domain in DOMAINS[DOMAINS.index(checkpoint['domain']):]:
+            start = checkpoint['offset'] if domain == checkpoint['domain'] \
+                else 0
+            for offset, objects in iter_pages(domain, app_id, start, workers):
+                for obj in objects:
+                    row = dict(obj.data, domain=domain)
+                    if writer is not None:
+                        writer.writerow([csv_cell(row.get(field))
+                                         for field in FIELDS])
+                    else:
+                        fp.write(json.dumps(row) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+                counts[domain] += len(objects)
+                stats.incr('exported_%ss' % domain, len(objects))
+                save_checkpoint(checkpoint_path,
+                                dict(domain=domain,
+                                     offset=offset + len(objects),
+                                     bytes=fp.tell()))
+    finally:
+        fp.close()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return counts
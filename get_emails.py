@@ -19,12 +19,24 @@ import logging
 logger = logging.getLogger('get_emails')  # Get unnamed root logger.
 import os
 import sys
+import errno
+import collections
+import multiprocessing
 import mailbox
+import email
 import email.Errors
+from email.parser import HeaderParser
 from email.utils import parsedate_tz
 from email.utils import mktime_tz
 from email.utils import formatdate
-from email.header import decode_header
+from email.utils import parseaddr
+
+import charsets
+from compact import compact_text
+from journal import PARSED, CREATED, ARCHIVED
+import lean_message
+from maildir_index import MaildirIndex
+import stats
 
 
 ch = logging.StreamHandler()
@@ -55,6 +67,40 @@ PROCESSED_MESSAGES_DIR = os.path.join(SYRIASPEAKINGGMAIL, 'PYBOSSA')
 # Save messages that have been sent to PyBossa.
 PROBLEMS_MESSAGES_DIR = os.path.join(SYRIASPEAKINGGMAIL, 'PROBLEMS')
 
+# Maildir key -> Date header index, so reruns only parse new mail.
+INBOX_INDEX = os.path.join(SYRIASPEAKINGGMAIL, 'INBOX.index.sqlite')
+
+# Journal of messages between INBOX, PyBossa tasks and PYBOSSA.
+INBOX_JOURNAL = os.path.join(SYRIASPEAKINGGMAIL, 'INBOX.journal')
+
+# Fingerprints of messages already sent, to drop duplicates.
+DEDUP_INDEX = os.path.join(SYRIASPEAKINGGMAIL, 'dedup.sqlite')
+
+# Attachments of sent messages, stored by SHA-256.
+ATTACHMENTS_DIR = os.path.join(SYRIASPEAKINGGMAIL, 'ATTACHMENTS')
+
+# Messages moved from INBOX to PYBOSSA per lock cycle.
+ARCHIVE_BATCH = 50
+
+def set_root(path):
+    """Use the Maildirs and state files under `path` instead.
+
+    For benchmarks and tests running against a throwaway copy of
+    SyriaSpeakingGmail.
+    """
+    global SYRIASPEAKINGGMAIL, INBOX, PROCESSED_MESSAGES_DIR
+    global PROBLEMS_MESSAGES_DIR, INBOX_INDEX, INBOX_JOURNAL, DEDUP_INDEX
+    global ATTACHMENTS_DIR
+    SYRIASPEAKINGGMAIL = path
+    INBOX = os.path.join(path, 'INBOX')
+    PROCESSED_MESSAGES_DIR = os.path.join(path, 'PYBOSSA')
+    PROBLEMS_MESSAGES_DIR = os.path.join(path, 'PROBLEMS')
+    INBOX_INDEX = os.path.join(path, 'INBOX.index.sqlite')
+    INBOX_JOURNAL = os.path.join(path, 'INBOX.journal')
+    DEDUP_INDEX = os.path.join(path, 'dedup.sqlite')
+    ATTACHMENTS_DIR = os.path.join(path, 'ATTACHMENTS')
+
+
 # http://ginstrom.com/scribbles/2007/11/19/parsing-multilingual-email-with-python/
 def get_charset2(message, default="ascii"):
     """Get the message charset."""
@@ -70,24 +116,8 @@ def get_charset2(message, default="ascii"):
     return default
 
 def get_multilingual_header(header_text, default="ascii"):
-    if not header_text is None:
-        try:
-            headers = header.decode_header(header_text)
-        except HeaderParseError:
-            return u"Error"
-
-        try:
-            header_sections = [
-                unicode(text, charset if charset and charset!='unknown' 
-                        else default, errors='replace') 
-                for text, charset in headers]
-        except LookupError:
-            header_sections = [unicode(text, default, errors='replace') 
-                               for text, charset in headers]
-
-        return u"".join(header_sections)
-    else:
-        return None
+    # Unknown charsets fall back to default; see charsets.
+    return charsets.decode_header_text(header_text, default)
 
 def decode_email(raw_email):
     raw_email = raw_email.replace('\r', ' ').replace(
@@ -127,36 +157,39 @@ def get_body(message):
         body = []
         for part in text_parts:
             charset = get_charset(part, get_charset(message))
-            body.append(unicode(part.get_payload(decode=True),
-                                charset,
-                                "replace"))
+            body.append(charsets.decode_text(part.get_payload(decode=True),
+                                             charset))
 
         return u"\n".join(body).strip()
 
     else: # if it is not multipart, the payload will be a string
           # representing the message body
-        body = unicode(message.get_payload(decode=True),
-                       get_charset(message),
-                       "replace")
+        body = charsets.decode_text(message.get_payload(decode=True),
+                                    get_charset(message))
         return body.strip()
 
 
 
 def get_multilingual_subject(message):
-    return ''.join([unicode(t[0], t[1] or 'ascii') 
-                    for t in decode_header(message['Subject'])])
+    return charsets.decode_header_text(message['Subject']) or u''
 
 
-def do_pybossa(message):
+def do_pybossa(message, compact=True):
 
+    subject = get_multilingual_subject(message)
     logger.debug('FROM:  %s' % message['from'])
-    logger.debug('SUBJECT:  %s' % get_multilingual_subject(message))
+    logger.debug('SUBJECT:  %s' % subject)
     logger.debug('DATE:  %s' % message['date'])
 
-    ret = {'msgs_text': get_body(message),
-           'msgs_html': [],
-           'msg_subject': get_multilingual_subject(message),
-           'msg_date': message['date']}
+    with stats.timer('do_pybossa'):
+        body = get_body(message)
+        ret = {'msgs_text': compact_text(body) if compact else body,
+               'msgs_text_chars': len(body),
+               'msgs_html': [],
+               'msg_subject': subject,
+               'msg_date': message['date'],
+               'msg_from': parseaddr(message['from'] or '')[1].lower(),
+               'msg_attachments': getattr(message, 'attachments', [])}
 
     return ret
 
@@ -257,70 +290,269 @@ def do_pybossa_trash(message):
     return ret
 
 
-def process_msg(key, inbox, pybossa, problems):
+class MaildirEntry(object):
+    """A message file in a Maildir, found by scan_maildir().
+
+    Only the header block is read during the scan, for the date, and
+    nothing of the file is kept: message() streams it again, so large
+    attachments are never held in memory.
+    """
+
+    def __init__(self, maildir_path, key, subpath, timestamp):
+        self.maildir_path = maildir_path
+        self.key = key
+        self.subpath = subpath
+        self.timestamp = timestamp
+
+    @property
+    def path(self):
+        return os.path.join(self.maildir_path, self.subpath)
+
+    def read(self):
+        """Return the raw message text."""
+        with open(self.path, 'r') as fp:
+            raw = fp.read()
+        stats.incr('bytes_read', len(raw))
+        return raw
+
+    def message(self, store=None):
+        """Parse the message as inbox[key] would, minus unneeded bodies.
+
+        Only text parts are decoded (see lean_message), and attachments
+        go to the AttachmentStore `store` if there is one.  The file is
+        streamed, so attachments are never held in memory.  The message
+        is only good for do_pybossa().
+        """
+        with open(self.path, 'r') as fp:
+            message = lean_message.message_from_file(
+                fp, mailbox.MaildirMessage, store)
+            stats.incr('bytes_read', fp.tell())
+        subdir, name = os.path.split(self.subpath)
+        message.set_subdir(subdir)
+        if mailbox.Maildir.colon in name:
+            message.set_info(name.split(mailbox.Maildir.colon)[-1])
+        return message
+
+
+def list_maildir(path):
+    """Yield (key, subpath) for every message file in new/ and cur/."""
+    for subdir in ('new', 'cur'):
+        for name in os.listdir(os.path.join(path, subdir)):
+            if name.startswith('.'):
+                continue
+            yield name.split(mailbox.Maildir.colon)[0], os.path.join(subdir,
+                                                                      name)
+
+
+def _read_headers(fp):
+    """Read a message file only up to the blank line ending its headers."""
+    lines = []
+    for line in iter(fp.readline, ''):
+        lines.append(line)
+        if line in ('\n', '\r\n'):
+            break
+    return ''.join(lines)
+
 
+def message_time(date, default):
+    """Seconds since the epoch for a Date header, else `default`."""
     try:
-        message = inbox[key]
+        # http://docs.python.org/2/library/email.util.html
+        return mktime_tz(parsedate_tz(date))
+    except (TypeError, ValueError, OverflowError):
+        logger.debug('Bad date header: %r' % date)
+        return default
+
+
+def scan_maildir(path, index=None):
+    """Return MaildirEntry objects for a Maildir, sorted by date.
+
+    Only the header block of each file is read and parsed.  With a
+    MaildirIndex, files whose size and mtime are unchanged since the
+    last scan are not opened at all.
+    """
+    parser = HeaderParser()
+    entries = []
+    for key, subpath in list_maildir(path):
+        filename = os.path.join(path, subpath)
+        if index is not None:
+            st = os.stat(filename)
+            timestamp = index.lookup(key, st.st_size, st.st_mtime)
+            if timestamp is not None:
+                # The file may have moved from new/ to cur/.
+                index.update(key, subpath, st.st_size, st.st_mtime,
+                             timestamp)
+                entries.append(MaildirEntry(path, key, subpath, timestamp))
+                continue
+
+        with open(filename, 'r') as fp:
+            st = os.fstat(fp.fileno())
+            header_text = _read_headers(fp)
+        stats.incr('bytes_read', len(header_text))
+        headers = parser.parsestr(header_text)
+        timestamp = message_time(headers['date'], st.st_mtime)
+        entries.append(MaildirEntry(path, key, subpath, timestamp))
+        if index is not None:
+            index.update(key, subpath, st.st_size, st.st_mtime, timestamp)
+
+    if index is not None:
+        index.commit()
+
+    entries.sort(key=lambda entry: entry.timestamp)
+    return entries
+
+
+def parse_file(path, store=None, compact=True):
+    """Task payload for a message file.  Runs in the process pool."""
+    try:
+        with open(path, 'r') as fp:
+            message = lean_message.message_from_file(fp, store=store)
     except email.Errors.MessageParseError:
-        # TODO:  Delete, move or process this somehow? Send note to admin?
-        return  # The message is malformed. Just leave it.
+        return {}  # The message is malformed. Just leave it.
+    return do_pybossa(message, compact)
 
-    ret = do_pybossa(message)
-    if len(ret) == 0:
-        return None
 
-    # Debugging.
-    if inbox == pybossa:
-        return ret
+def parse_parallel(entries, numcores, store=None, compact=True):
+    """Yield (entry, ret) with ret = parse_file(entry.path, store, compact),
+    in order.
 
+    `numcores` worker processes each read and parse their own files;
+    only the paths and payloads cross between processes.  At most
+    4 * numcores messages are in flight at once.
+    """
+    pool = multiprocessing.Pool(numcores)
+    pending = collections.deque()
     try:
-        # Write copy to disk before removing original.
-        # If there's a crash, you might duplicate a message, but
-        # that's better than losing a message completely.
-        pybossa.lock()
-        pybossa.add(message)
-        pybossa.flush()
+        for entry in entries:
+            pending.append((entry, pool.apply_async(
+                parse_file, (entry.path, store, compact))))
+            if len(pending) >= 4 * numcores:
+                entry, result = pending.popleft()
+                yield entry, result.get()
+        while pending:
+            entry, result = pending.popleft()
+            yield entry, result.get()
+    finally:
+        pool.close()
+        pool.join()
 
-    # Not sure yet what errors might appear but I know that we want to
-    # err on the conservative side and not delete anything from inbox
-    # if there is an error.
-    except Exception, err:
 
-        # TODO: Should probably try to add these to problems maildir...
+def process_msg(entry, parsed=None, store=None, compact=True):
+    """Return (message, ret) for one message, ret being its task payload.
 
-        logger.exception('Make specific exception 1.\n%s' % err.message)
-        return None
+    `parsed` is ret when parse_parallel() already did the work.  The
+    message is always None: the parsed message lacks its attachments,
+    so it must not be archived in place of the file.
+    """
+
+    if parsed is not None:
+        return None, parsed
+
+    with stats.timer('process_msg'):
+        try:
+            message = entry.message(store)
+        except email.Errors.MessageParseError:
+            # TODO:  Delete, move or process this somehow? Send note to admin?
+            stats.error('process_msg')
+            return None, {}  # The message is malformed. Just leave it.
+
+        return None, do_pybossa(message, compact)
 
-    finally:
-        pybossa.unlock()
 
+def archive_msgs(batch, inbox, pybossa):
+    """Move a batch of (entry, message) pairs from inbox to pybossa.
 
+    `message` may be None, in which case the file is read if it has to
+    be copied rather than renamed.
+
+    Each mailbox is locked and flushed once per batch.  Message files
+    are renamed into PYBOSSA under the same subdir and name, which is
+    atomic on one filesystem: after a crash every message is in exactly
+    one of the two Maildirs.  Returns the entries that were moved.
+    """
+
+    archived = []
+    pybossa.lock()
+    inbox.lock()
     try:
-        # Remove original message.  This only removes the message from
-        # local INBOX dir not from the remote server.
-        inbox.lock()
-        inbox.discard(key)
-        inbox.flush()
+        for entry, message in batch:
+            dest = os.path.join(PROCESSED_MESSAGES_DIR, entry.subpath)
+            try:
+                if os.path.exists(dest):
+                    raise OSError(errno.EEXIST, 'File exists', dest)
+                os.rename(entry.path, dest)
+                archived.append(entry)
+                continue
+            except OSError, err:
+                if err.errno not in (errno.EXDEV, errno.EEXIST):
+                    logger.exception('Could not move %s.\n%s' % (entry.path,
+                                                                  err))
+                    continue
 
-    except Exception, err:
-        # TODO: Should probably check ret and all now.
-        logger.exception('Make specific exception 2.\n%s' % err.message)
+            # PYBOSSA is on another filesystem or the name is taken.
+            try:
+                # Write copy to disk before removing original.
+                # If there's a crash, you might duplicate a message, but
+                # that's better than losing a message completely.
+                if message is None:
+                    message = entry.read()
+                pybossa.add(message)
+
+            # Not sure yet what errors might appear but I know that we want to
+            # err on the conservative side and not delete anything from inbox
+            # if there is an error.
+            except Exception, err:
+
+                # TODO: Should probably try to add these to problems maildir...
+
+                logger.exception('Make specific exception 1.\n%s' % err.message)
+                continue
+
+            try:
+                # Remove original message.  This only removes the message from
+                # local INBOX dir not from the remote server.
+                inbox.discard(entry.key)
+
+            except Exception, err:
+                # TODO: Should probably check ret and all now.
+                logger.exception('Make specific exception 2.\n%s' % err.message)
+
+            archived.append(entry)
+
+        pybossa.flush()
+        inbox.flush()
 
     finally:
         inbox.unlock()
+        pybossa.unlock()
 
-    return ret
+    return archived
 
 
-def get_emails():
+def iter_emails(numcores=1, batch_size=ARCHIVE_BATCH, journal=None,
+                store=None, compact=True):
+    """Yield PyBossa task payloads from INBOX, oldest message first.
+
+    Messages are parsed, moved to PYBOSSA `batch_size` at a time and
+    then yielded, so a consumer can start creating tasks straight away.
+    With numcores > 1 the MIME parsing and charset decoding run in a
+    pool of that many processes.
 
-    msgs = []
+    With an IngestJournal nothing is moved here: messages journalled as
+    created or archived are skipped, the rest are journalled as parsed
+    and left in INBOX until archive_created() runs after their tasks
+    exist.  Each payload carries its Maildir key as 'msg_key'.
+
+    With an attachments.AttachmentStore, attachments are saved to it and
+    listed in 'msg_attachments'.  With compact, bodies are sent without
+    quoted replies, signatures and extra whitespace.
+    """
 
     try:
         inbox = mailbox.Maildir(INBOX, factory=None, create=False)
     except mailbox.NoSuchMailboxError:
         logger.critical("You must run 'offlineimap.py' to sync email.")
-        return msgs
+        return
 
     pybossa = mailbox.Maildir(PROCESSED_MESSAGES_DIR, factory=None, create=True)
     problems = mailbox.Maildir(PROBLEMS_MESSAGES_DIR, factory=None, create=True)
@@ -337,18 +569,105 @@ def get_emails():
     ## inbox = pybossa
 
     # Sort by date, but must parse date header to actual time object.
-    date_keys = []
-    for key, msg in inbox.iteritems():
-        # http://docs.python.org/2/library/email.util.html
-        date_keys.append((mktime_tz(parsedate_tz(msg['date'])), key))
+    # The scan reads only the headers; process_msg() streams the rest.
+    # Dates of messages seen on earlier runs come from the index.
+    index = MaildirIndex(INBOX_INDEX)
+    try:
+        with stats.timer('scan_maildir'):
+            entries = scan_maildir(INBOX, index=index)
+        stats.incr('messages_scanned', len(entries))
+        if journal is not None:
+            entries = [entry for entry in entries
+                       if journal.state(entry.key) in (None, PARSED)]
+        if numcores > 1:
+            entries = parse_parallel(entries, numcores, store, compact)
+        else:
+            entries = ((entry, None) for entry in entries)
+
+        batch = []
+        for entry, parsed in entries:
+            message, ret = process_msg(entry, parsed, store, compact)
+            if len(ret) == 0:
+                stats.incr('messages_malformed')
+                continue
+            ret['msg_key'] = entry.key
+            stats.incr('messages_parsed')
+
+            if journal is not None:
+                journal.record(entry.key, PARSED)
+                yield ret
+                continue
+
+            # Debugging.
+            if inbox == pybossa:
+                yield ret
+                continue
 
-    for date_key in sorted(date_keys, key=lambda x: x[0]):
-        ret = process_msg(date_key[1], inbox, pybossa, problems)
-        if ret:
-            msgs.append(ret)
+            batch.append((entry, message, ret))
+            if len(batch) >= batch_size:
+                for ret in _archive_batch(batch, inbox, pybossa):
+                    yield ret
+                batch = []
 
-    inbox.close()
-    pybossa.close()
-    problems.close()
+        for ret in _archive_batch(batch, inbox, pybossa):
+            yield ret
 
-    return msgs
+    finally:
+        index.close()
+        inbox.close()
+        pybossa.close()
+        problems.close()
+
+
+def _archive_batch(batch, inbox, pybossa):
+    """Archive (entry, message, ret) triples, returning moved payloads."""
+    if not batch:
+        return []
+    with stats.timer('archive'):
+        archived = set(archive_msgs([(entry, message)
+                                     for entry, message, ret in batch],
+                                    inbox, pybossa))
+    stats.incr('messages_archived', len(archived))
+    return [ret for entry, message, ret in batch if entry in archived]
+
+
+def archive_created(journal, batch_size=ARCHIVE_BATCH):
+    """Move messages journalled as created from INBOX to PYBOSSA.
+
+    Returns the number of messages archived.
+    """
+
+    created = set(journal.keys(CREATED))
+    if not created:
+        return 0
+
+    try:
+        inbox = mailbox.Maildir(INBOX, factory=None, create=False)
+    except mailbox.NoSuchMailboxError:
+        logger.critical("You must run 'offlineimap.py' to sync email.")
+        return 0
+
+    pybossa = mailbox.Maildir(PROCESSED_MESSAGES_DIR, factory=None, create=True)
+
+    entries = [MaildirEntry(INBOX, key, subpath, None)
+               for key, subpath in list_maildir(INBOX) if key in created]
+    n_archived = 0
+    try:
+        for i in xrange(0, len(entries), batch_size):
+            batch = [(entry, None) for entry in entries[i:i + batch_size]]
+            with stats.timer('archive'):
+                archived = archive_msgs(batch, inbox, pybossa)
+            stats.incr('messages_archived', len(archived))
+            for entry in archived:
+                journal.record(entry.key, ARCHIVED,
+                               journal.task_id(entry.key))
+                n_archived += 1
+    finally:
+        inbox.close()
+        pybossa.close()
+
+    return n_archived
+
+
+def get_emails():
+    return list(iter_emails())
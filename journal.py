@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Append-only journal of INBOX messages on their way to PyBossa.
+
+Every message goes through three states, each written as one JSON line:
+
+    parsed    the payload was handed to task creation
+    created   PyBossa accepted the task (the line carries its task id)
+    archived  the message file was moved from INBOX to PYBOSSA
+
+A restarted run skips messages that already have a task and only
+archives them, so nothing is posted twice or left behind.
+
+A message whose body is split over several tasks stays parsed until
+all of them exist.  Each part posted so far is journalled with its task
+id (a 'part' line), so a restarted run only posts the missing ones.
+"""
+
+import json
+import os
+import threading
+
+PARSED = 'parsed'
+CREATED = 'created'
+ARCHIVED = 'archived'
+
+
+class IngestJournal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.states = {}
+        # key -> {part number: task id} of split messages not yet created.
+        self.parts = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line after a crash.
+                    if 'part' in record:
+                        self.parts.setdefault(record['key'], {})[
+                            record['part']] = record['task_id']
+                        continue
+                    self.states[record['key']] = (record['state'],
+                                                  record.get('task_id'))
+                    if record['state'] != PARSED:
+                        self.parts.pop(record['key'], None)
+        self.fp = open(path, 'a')
+
+    def state(self, key):
+        return self.states.get(key, (None, None))[0]
+
+    def task_id(self, key):
+        return self.states.get(key, (None, None))[1]
+
+    def posted_parts(self, key):
+        """{part number: task id} of the parts of `key` posted so far."""
+        return dict(self.parts.get(key, {}))
+
+    def keys(self, state):
+        return [key for key, (s, task_id) in self.states.iteritems()
+                if s == state]
+
+    def record(self, key, state, task_id=None):
+        """Append a state change.  Task creation is synced to disk."""
+        line = json.dumps(dict(key=key, state=state, task_id=task_id))
+        with self.lock:
+            self.states[key] = (state, task_id)
+            if state != PARSED:
+                self.parts.pop(key, None)
+            self.fp.write(line + '\n')
+            self.fp.flush()
+            if state == CREATED:
+                os.fsync(self.fp.fileno())
+
+    def record_part(self, key, part, task_id):
+        """Append the task of one part of a split message.
+
+        Returns the parts posted so far, as posted_parts() does.
+        """
+        line = json.dumps(dict(key=key, state=PARSED, part=part,
+                               task_id=task_id))
+        with self.lock:
+            parts = self.parts.setdefault(key, {})
+            parts[part] = task_id
+            self.fp.write(line + '\n')
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            return dict(parts)
+
+    def close(self):
+        """Rewrite the journal without the messages already archived."""
+        with self.lock:
+            self.fp.close()
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as fp:
+                for key, (state, task_id) in self.states.iteritems():
+                    if state != ARCHIVED:
+                        fp.write(json.dumps(dict(key=key, state=state,
+                                                 task_id=task_id)) + '\n')
+                for key, parts in self.parts.iteritems():
+                    for part, task_id in sorted(parts.iteritems()):
+                        fp.write(json.dumps(dict(key=key, state=PARSED,
+                                                 part=part,
+                                                 task_id=task_id)) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.rename(tmp, self.path)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Parse email without the bodies of parts that get_body() ignores.
+
+The raw message is read line by line.  Every header is kept, and so is
+the MIME structure, but only the bodies of text/plain (and message/*)
+parts, or of a single part text message, reach the email parser.
+Images, PDFs and HTML alternatives become empty parts, so they are
+never decoded or held in memory as Message payloads.
+
+    message = message_from_file(fp)
+    get_body(message)  # Same as for email.message_from_file(fp).
+
+Given an attachments.AttachmentStore, the bodies of non-text parts are
+streamed into it instead, and message.attachments lists their
+references.
+"""
+
+import cStringIO
+from email.feedparser import FeedParser
+from email.parser import HeaderParser
+
+FEED_BYTES = 64 * 1024
+
+
+def keep_body(part, multipart_parent):
+    """Whether the body of a part with these headers is needed."""
+    maintype = part.get_content_maintype()
+    if not multipart_parent and maintype == 'text':
+        return True  # A single part message: its body is the text.
+    return part.get_content_type() == 'text/plain' or maintype == 'message'
+
+
+def is_attachment(part):
+    return part.get_content_maintype() not in ('text', 'multipart', 'message')
+
+
+def filter_lines(lines, store=None, attachments=None):
+    """Yield the lines of a raw message, leaving out unneeded bodies.
+
+    With a `store`, non-text bodies are written to it and their
+    references appended to `attachments`.
+    """
+    parser = HeaderParser()
+    boundaries = []     # Delimiters of the enclosing multiparts.
+    header = []         # Header lines of the current part.
+    in_header = True
+    keep = True
+    writer = None       # Where the current attachment body goes.
+    try:
+        for line in lines:
+            if in_header:
+                yield line
+                if line not in ('\n', '\r\n'):
+                    header.append(line)
+                    continue
+                part = parser.parsestr(''.join(header))
+                header = []
+                in_header = False
+                if part.get_content_maintype() == 'multipart':
+                    boundary = part.get_boundary()
+                    if boundary is not None:
+                        boundaries.append('--' + boundary)
+                    keep = True     # Preamble.
+                else:
+                    keep = keep_body(part, bool(boundaries))
+                    if store is not None and is_attachment(part):
+                        writer = store.writer(part)
+                continue
+
+            if line.startswith('--') and boundaries:
+                delimiter = line.rstrip('\r\n').rstrip(' \t')
+                end = delimiter.endswith('--') and \
+                    delimiter[:-2] in boundaries
+                if end or delimiter in boundaries:
+                    if writer is not None:
+                        attachments.append(writer.close())
+                        writer = None
+                    yield line
+                if end:
+                    del boundaries[boundaries.index(delimiter[:-2]):]
+                    keep = True     # Epilogue.
+                    continue
+                if delimiter in boundaries:
+                    # Parts nested deeper than this boundary are over.
+                    del boundaries[boundaries.index(delimiter) + 1:]
+                    in_header = True
+                    continue
+
+            if keep:
+                yield line
+            elif writer is not None:
+                writer.write(line)
+
+        if writer is not None:
+            # A single part message, or a truncated multipart one.
+            attachments.append(writer.close())
+            writer = None
+    finally:
+        if writer is not None:
+            writer.abort()
+
+
+def message_from_lines(lines, _class=None, store=None):
+    kwargs = {} if _class is None else dict(_factory=_class)
+    parser = FeedParser(**kwargs)
+    attachments = []
+    # FeedParser splits what it is fed into lines again, so feed it
+    # runs of lines rather than one call per line.
+    chunk = []
+    size = 0
+    for line in filter_lines(lines, store, attachments):
+        chunk.append(line)
+        size += len(line)
+        if size >= FEED_BYTES:
+            parser.feed(''.join(chunk))
+            chunk = []
+            size = 0
+    parser.feed(''.join(chunk))
+    message = parser.close()
+    message.attachments = attachments
+    return message
+
+
+def message_from_file(fp, _class=None, store=None):
+    return message_from_lines(iter(fp.readline, ''), _class, store)
+
+
+def message_from_string(raw, _class=None, store=None):
+    return message_from_file(cStringIO.StringIO(raw), _class, store)
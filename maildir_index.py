@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk index of Maildir keys and their parsed Date headers.
+
+get_emails.scan_maildir() only parses the headers of files whose size
+or mtime differ from what is recorded here, so a rerun over an INBOX it
+has already seen is a directory listing plus one SELECT.
+"""
+
+import logging
+logger = logging.getLogger('get_emails')
+import sqlite3
+
+
+class MaildirIndex(object):
+    """Maildir key -> (subpath, size, mtime, timestamp), kept in SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'key TEXT PRIMARY KEY, '
+                        'subpath TEXT NOT NULL, '
+                        'size INTEGER NOT NULL, '
+                        'mtime REAL NOT NULL, '
+                        'timestamp REAL NOT NULL)')
+        self.db.commit()
+        self.entries = dict(
+            (row[0], row[1:]) for row in
+            self.db.execute('SELECT key, subpath, size, mtime, timestamp '
+                            'FROM entries'))
+        self.seen = set()
+
+    def lookup(self, key, size, mtime):
+        """Return the indexed timestamp, or None if the file changed."""
+        self.seen.add(key)
+        row = self.entries.get(key)
+        if row is None or row[1] != size or row[2] != mtime:
+            return None
+        return row[3]
+
+    def update(self, key, subpath, size, mtime, timestamp):
+        self.seen.add(key)
+        row = self.entries.get(key)
+        if row == (subpath, size, mtime, timestamp):
+            return
+        self.entries[key] = (subpath, size, mtime, timestamp)
+        self.db.execute('INSERT OR REPLACE INTO entries '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (key, subpath, size, mtime, timestamp))
+
+    def discard(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def commit(self):
+        """Drop keys not seen since the index was opened, then save."""
+        gone = [key for key in self.entries if key not in self.seen]
+        for key in gone:
+            self.discard(key)
+        self.db.commit()
+        logger.debug('Index %s: %d entries, %d removed.' % (
+            self.path, len(self.entries), len(gone)))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Build a synthetic Maildir of Arabic and English email for benchmarks.
+
+The mix is meant to look like the SyriaSpeaking inbox: plain and
+multipart/alternative messages, some with image or PDF attachments,
+utf-8 and windows-1256 bodies in base64, quoted-printable or 8bit,
+RFC 2047 encoded subjects with reply chains, quoted reply history and
+signatures, and a few missing or broken Date headers.
+
+    python make_corpus.py --messages 100000 --maildir /tmp/corpus/INBOX
+"""
+
+
+#------------------------------------------------------------------------------
+# Logging--formatters, handlers, etc. added below in set_logging().
+#------------------------------------------------------------------------------
+import logging
+logger = logging.getLogger()  # Get unnamed root logger.
+
+
+#------------------------------------------------------------------------------
+# Built-in modules
+#------------------------------------------------------------------------------
+import base64
+import os
+import quopri
+import random
+import socket
+import sys
+import time
+from email.header import Header
+from email.message import Message
+from email.mime.application import MIMEApplication
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.utils import formatdate
+
+
+#------------------------------------------------------------------------------
+# Our modules
+#------------------------------------------------------------------------------
+from rw_io import default_parser
+from rw_io import set_logging
+
+
+#------------------------------------------------------------------------------
+# Constants
+#------------------------------------------------------------------------------
+ARABIC_WORDS = (u'مرحبا سوريا حلب دمشق حمص الشعب الحرية اليوم غدا الناس '
+                u'المدينة الطعام الماء الدواء المستشفى الأطفال البيت الطريق '
+                u'نحن نريد نحتاج ساعدونا شكرا كثيرا الأخبار الوضع صعب جدا '
+                u'في من إلى على مع عن هذا هذه').split()
+
+ENGLISH_WORDS = ('hello syria aleppo damascus homs people freedom today '
+                 'tomorrow city food water medicine hospital children home '
+                 'road we need help thanks news situation very hard in from '
+                 'to on with about this').split()
+
+SUBJECTS = [u'أخبار من حلب', u'نحتاج مساعدة', u'الوضع في حمص', u'شكرا',
+            u'News from Aleppo', u'Please help', u'Situation report',
+            u'رسالة من دمشق']
+
+BROKEN_DATES = ['', 'yesterday', 'Mon, 32 Foo 2013 99:99:99', '0', 'None']
+
+# 1x1 PNG, repeated to the attachment size.
+PNG = base64.decodestring(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChw'
+    'GA60e6kgAAAABJRU5ErkJggg==')
+
+
+#------------------------------------------------------------------------------
+# Command line parsing and usage
+#------------------------------------------------------------------------------
+def process_command_line(argv):
+    parser = default_parser(__doc__)
+    parser.add_argument('--maildir',
+                        help="Maildir to create or add to.",
+                        action="store",
+                        default=os.path.join('corpus', 'INBOX'))
+    parser.add_argument('--messages',
+                        help="Number of messages to write.",
+                        action="store",
+                        type=int,
+                        default=10000)
+    parser.add_argument('--seed',
+                        help="Random seed, so corpora can be rebuilt.",
+                        action="store",
+                        type=int,
+                        default=0)
+    parser.add_argument('--attachment-rate',
+                        help="Fraction of messages with an attachment.",
+                        action="store",
+                        type=float,
+                        default=0.1)
+    parser.add_argument('--attachment-kb',
+                        help="Largest attachment size in KB.",
+                        action="store",
+                        type=int,
+                        default=200)
+    args = parser.parse_args(argv)
+    return args
+
+
+#------------------------------------------------------------------------------
+# Internal functions & classes
+#------------------------------------------------------------------------------
+def paragraph(rng, arabic=True):
+    words = ARABIC_WORDS if arabic else ENGLISH_WORDS
+    n = rng.randint(5, 60)
+    return u' '.join(rng.choice(words) for i in xrange(n)) + u'.'
+
+
+def body_text(rng, arabic=True):
+    paragraphs = [paragraph(rng, arabic)
+                  for i in xrange(rng.choice((1, 1, 2, 3, 5, 10)))]
+    if rng.random() < 0.3:
+        quoted = u'\n'.join(u'> ' + paragraph(rng, arabic)
+                            for i in xrange(rng.randint(2, 20)))
+        paragraphs.append(u'On %s, someone wrote:\n%s' % (formatdate(), quoted))
+    if rng.random() < 0.3:
+        paragraphs.append(u'-- \n' + u' '.join(rng.sample(ARABIC_WORDS, 3)))
+    return u'\n\n'.join(paragraphs)
+
+
+def text_part(subtype, text, charset, encoding):
+    part = Message()
+    data = text.encode(charset, 'replace')
+    if encoding == 'base64':
+        data = base64.encodestring(data)
+    elif encoding == 'quoted-printable':
+        data = quopri.encodestring(data)
+    part['Content-Type'] = 'text/%s; charset="%s"' % (subtype, charset)
+    part['Content-Transfer-Encoding'] = encoding
+    part.set_payload(data)
+    return part
+
+
+def attachment(rng, max_kb):
+    size = rng.randint(1, max_kb) * 1024
+    if rng.random() < 0.7:
+        part = MIMEImage(PNG * (size / len(PNG) + 1), 'png')
+        filename = 'photo.png'
+    else:
+        part = MIMEApplication('%PDF-1.4\n' + 'x' * size, 'pdf')
+        filename = 'letter.pdf'
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+def make_message(rng, i, now, attachment_rate=0.1, attachment_kb=200):
+    arabic = rng.random() < 0.8
+    charset = rng.choice(('utf-8', 'utf-8', 'windows-1256')) if arabic \
+        else rng.choice(('utf-8', 'us-ascii'))
+    encoding = rng.choice(('base64', 'base64', 'quoted-printable',
+                           'quoted-printable', '8bit'))
+    text = body_text(rng, arabic)
+
+    if rng.random() < 0.5:
+        message = MIMEMultipart('alternative')
+        message.attach(text_part('plain', text, charset, encoding))
+        html = u'<html><body><p>%s</p></body></html>' % (
+            text.replace(u'\n\n', u'</p><p>'))
+        message.attach(text_part('html', html, charset, encoding))
+    else:
+        message = text_part('plain', text, charset, encoding)
+
+    if rng.random() < attachment_rate:
+        mixed = MIMEMultipart('mixed')
+        mixed.attach(message)
+        mixed.attach(attachment(rng, attachment_kb))
+        message = mixed
+
+    subject = rng.choice(SUBJECTS)
+    subject = u'Re: ' * rng.choice((0, 0, 0, 1, 2)) + subject
+    try:
+        subject.encode('ascii')
+        message['Subject'] = subject
+    except UnicodeEncodeError:
+        header_charset = 'windows-1256' if charset == 'windows-1256' \
+            else 'utf-8'
+        message['Subject'] = Header(subject, header_charset)
+
+    message['From'] = 'sender%d@example.com' % rng.randint(1, 500)
+    message['To'] = 'syriaspeaking@gmail.com'
+    r = rng.random()
+    if r < 0.01:
+        pass  # No Date header at all.
+    elif r < 0.04:
+        message['Date'] = rng.choice(BROKEN_DATES)
+    else:
+        message['Date'] = formatdate(now - 60 * i - rng.randint(0, 59))
+    return message.as_string()
+
+
+def make_corpus(path, n_messages, seed=0, attachment_rate=0.1,
+                attachment_kb=200):
+    """Write `n_messages` synthetic messages into the Maildir at `path`.
+
+    Files are written straight into new/ rather than through
+    mailbox.Maildir.add(), which fsyncs every message.
+    """
+    for subdir in ('tmp', 'new', 'cur'):
+        if not os.path.isdir(os.path.join(path, subdir)):
+            os.makedirs(os.path.join(path, subdir))
+
+    rng = random.Random(seed)
+    now = time.time()
+    host = socket.gethostname().replace('/', '_').replace(':', '_')
+    for i in xrange(n_messages):
+        raw = make_message(rng, i, now, attachment_rate, attachment_kb)
+        name = '%d.M%dP%dQ%d.%s' % (now, i, os.getpid(), seed, host)
+        with open(os.path.join(path, 'new', name), 'w') as fp:
+            fp.write(raw)
+        if i and i % 10000 == 0:
+            logger.info('%d messages written.' % i)
+
+
+#------------------------------------------------------------------------------
+# Main routine
+#------------------------------------------------------------------------------
+def main(args=None):
+
+    # Useful if this function used as module, called from other function.
+    if args is None:
+        args = process_command_line(sys.argv[1:])
+
+    start = time.time()
+    make_corpus(args.maildir, args.messages, args.seed,
+                args.attachment_rate, args.attachment_kb)
+    logger.info('%d messages written to %s in %.1f s.' % (
+        args.messages, args.maildir, time.time() - start))
+
+
+#------------------------------------------------------------------------------
+# Import or standalone test
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+    args = process_command_line(sys.argv[1:])
+    set_logging(logger, args)
+    main(args)
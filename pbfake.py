@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-memory stand-in for the PyBossa REST API that pbclient talks to.
+
+Serves /api/app, /api/task and /api/taskrun (GET with filters, limit and
+offset; POST; PUT and DELETE by id) with optional latency and error
+injection, so createTasks.py can be run and timed without a live
+server:
+
+    python pbfake.py --port 5001 --latency 0.02 --error-rate 0.01
+    python createTasks.py -s http://localhost:5001 -k fake -c
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import optparse
+import random
+import threading
+import time
+import urlparse
+
+
+class FakePyBossa(object):
+    """The fake server's data and its HTTP server thread."""
+
+    domains = ('app', 'task', 'taskrun')
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=500,
+                 error_methods=('POST', 'PUT', 'DELETE'),
+                 error_domains=domains):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.error_methods = error_methods
+        self.error_domains = error_domains
+        self.lock = threading.Lock()
+        self.tables = dict((domain, {}) for domain in self.domains)
+        self.next_id = dict((domain, 1) for domain in self.domains)
+        # (method, domain, status, seconds) for every request served.
+        self.log = []
+
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.httpd.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def add(self, domain, data):
+        with self.lock:
+            obj = dict(data)
+            obj['id'] = self.next_id[domain]
+            self.next_id[domain] += 1
+            if domain == 'app':
+                obj.setdefault('info', {})
+                obj.setdefault('long_description', '')
+            elif domain == 'task':
+                obj.setdefault('n_answers', 30)
+                obj.setdefault('quorum', 0)
+                obj.setdefault('info', {})
+            self.tables[domain][obj['id']] = obj
+            return obj
+
+    def find(self, domain, filters, limit=100, offset=0):
+        with self.lock:
+            found = [obj for id, obj in sorted(self.tables[domain].items())
+                     if all(unicode(obj.get(k)) == v
+                            for k, v in filters.iteritems())]
+        return found[offset:offset + limit]
+
+    def handle(self, method, path, query, body):
+        """Return (status, data) for one API request."""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        parts = [p for p in path.split('/') if p]
+        if (self.error_rate and method in self.error_methods
+                and parts[1:2] and parts[1] in self.error_domains
+                and random.random() < self.error_rate):
+            return self.error_status, dict(status='failed',
+                                           status_code=self.error_status)
+
+        if len(parts) < 2 or parts[0] != 'api' or parts[1] not in self.domains:
+            return 404, dict(status='failed', status_code=404)
+        domain = parts[1]
+        id = int(parts[2]) if len(parts) > 2 else None
+
+        if method == 'GET':
+            if id is not None:
+                obj = self.tables[domain].get(id)
+                return (200, obj) if obj else (404, None)
+            filters = dict(query)
+            filters.pop('api_key', None)
+            limit = int(filters.pop('limit', 20))
+            offset = int(filters.pop('offset', 0))
+            return 200, self.find(domain, filters, limit, offset)
+
+        if method == 'POST' and id is None:
+            return 200, self.add(domain, body)
+
+        if method in ('PUT', 'DELETE') and id is not None:
+            with self.lock:
+                if id not in self.tables[domain]:
+                    return 404, None
+                if method == 'DELETE':
+                    del self.tables[domain][id]
+                    return 204, None
+                obj = self.tables[domain][id]
+                obj.update(body)
+                obj['id'] = id
+                return 200, obj
+
+        return 405, dict(status='failed', status_code=405)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients dropping keep-alive connections.
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients reuse their connections.  Responses
+    # go out in one buffered write so delayed ACKs don't add latency.
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _serve(self, method):
+        start = time.time()
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = None
+        if length:
+            try:
+                body = json.loads(self.rfile.read(length))
+            except ValueError:
+                body = None
+
+        fake = self.server.fake
+        status, data = fake.handle(method, url.path, query, body or {})
+        payload = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+        parts = [p for p in url.path.split('/') if p]
+        domain = parts[1] if len(parts) > 1 else None
+        with fake.lock:
+            fake.log.append((method, domain, status, time.time() - start))
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_POST(self):
+        self._serve('POST')
+
+    def do_PUT(self):
+        self._serve('PUT')
+
+    def do_DELETE(self):
+        self._serve('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = optparse.OptionParser("usage: %prog [options]")
+    parser.add_option("--host", dest="host", default="127.0.0.1")
+    parser.add_option("--port", dest="port", type="int", default=5001)
+    parser.add_option("--latency", dest="latency", type="float", default=0.0,
+                      help="Seconds added to every request")
+    parser.add_option("--jitter", dest="jitter", type="float", default=0.0,
+                      help="Up to this many more random seconds")
+    parser.add_option("--error-rate", dest="error_rate", type="float",
+                      default=0.0, help="Fraction of requests that fail")
+    parser.add_option("--error-status", dest="error_status", type="int",
+                      default=500, help="HTTP status of injected failures")
+    parser.add_option("--error-methods", dest="error_methods",
+                      default="POST,PUT,DELETE",
+                      help="Comma separated HTTP methods that may fail")
+    parser.add_option("--error-domains", dest="error_domains",
+                      default=",".join(FakePyBossa.domains),
+                      help="Comma separated API domains that may fail")
+    (options, args) = parser.parse_args()
+
+    fake = FakePyBossa(options.host, options.port, options.latency,
+                       options.jitter, options.error_rate,
+                       options.error_status,
+                       options.error_methods.upper().split(','),
+                       options.error_domains.split(','))
+    print "Fake PyBossa listening at %s" % fake.url
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
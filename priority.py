@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Task priorities, so fresh and urgent messages are served first.
+
+PyBossa hands out tasks with a higher priority_0 (0 to 1) first.  A
+scorer is any callable taking a task payload of get_emails.iter_emails()
+and returning such a number.  Scorer, the default one, is the weighted
+mean of:
+
+    recency   1 for a message sent now, halving every half_life_hours
+    sender    1 if the sender's address is in senders
+    keywords  1 if the subject or text contains one of keywords
+    length    1 for an empty body, 1/2 at length_scale characters
+
+by_priority() keeps up to `size` parsed messages in a heap (a
+rw_io.prefetch() buffer) and hands out the highest scored one first, so
+when tasks are posted more slowly than mail is parsed the urgent
+messages jump the queue.
+"""
+
+import sys
+import time
+
+import pbclient
+from get_emails import message_time
+from rw_io import prefetch
+
+DEFAULTS = dict(weights=dict(recency=1.0, sender=1.0, keywords=1.0,
+                             length=0.0),
+                senders=[],
+                keywords=[],
+                half_life_hours=24.0,
+                length_scale=1000)
+
+# Parsed messages held in the heap.
+WINDOW = 1000
+
+
+class Scorer(object):
+
+    def __init__(self, config=None):
+        config = dict(DEFAULTS, **(config or {}))
+        self.weights = dict(DEFAULTS['weights'], **config['weights'])
+        self.senders = set(sender.lower() for sender in config['senders'])
+        self.words = [keyword.lower() for keyword in config['keywords']]
+        self.half_life = 3600.0 * config['half_life_hours']
+        self.length_scale = float(config['length_scale'])
+
+    def recency(self, msg, now):
+        sent = message_time(msg.get('msg_date'), None)
+        if sent is None:
+            return 0.0
+        age = max(0.0, now - sent)
+        return 0.5 ** (age / self.half_life)
+
+    def sender(self, msg, now):
+        return 1.0 if msg.get('msg_from') in self.senders else 0.0
+
+    def keywords(self, msg, now):
+        text = (msg.get('msg_subject') or u'') + u'\n' + msg['msgs_text']
+        text = text.lower()
+        return 1.0 if any(word in text for word in self.words) \
+            else 0.0
+
+    def length(self, msg, now):
+        return 1.0 / (1.0 + len(msg['msgs_text']) / self.length_scale)
+
+    def __call__(self, msg, now=None):
+        if now is None:
+            now = time.time()
+        total = sum(self.weights.itervalues())
+        if not total:
+            return 0.0
+        score = sum(weight * getattr(self, name)(msg, now)
+                    for name, weight in self.weights.iteritems() if weight)
+        return round(score / total, 4)
+
+
+def load_scorer(spec):
+    """The callable named by 'module:function' (or module.function)."""
+    module, _, name = spec.replace(':', '.').rpartition('.')
+    if not module:
+        raise ValueError('Expected MODULE:FUNCTION, got %r' % spec)
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+
+def by_priority(iterable, score, size=WINDOW):
+    """Iterate over `iterable` highest score(item) first.
+
+    Up to `size` items are read ahead in a background thread; items of
+    equal score keep their order.  Each item dict gets its score as
+    'priority_0'.
+    """
+    def scored():
+        for item in iterable:
+            item['priority_0'] = score(item)
+            yield item
+
+    return prefetch(scored(), size, key=lambda item: -item['priority_0'])
+
+
+def create_task(app_id, info, priority_0=0):
+    """pbclient.create_task() with a priority."""
+    task = dict(app_id=app_id, state=0, calibration=0, priority_0=priority_0,
+                info=info)
+    return pbclient._pybossa_req('post', 'task', payload=task)
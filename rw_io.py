@@ -1,7 +1,10 @@
 import argparse
+import itertools
 import logging
 import os
+import Queue
 import sys
+import threading
 
 
 # http://code.activestate.com/recipes/52308/
@@ -11,6 +14,48 @@ class Bunch:
         self.__dict__.update(kwds)
 
 
+def prefetch(iterable, size=1, key=None):
+    """Iterate over `iterable` in a background thread.
+
+    At most `size` items are buffered ahead of the consumer, so the
+    producer and consumer overlap without memory growing with the
+    length of `iterable`.  Exceptions in the producer are re-raised in
+    the consumer.
+
+    With `key`, the buffer is a heap: the buffered item with the lowest
+    key(item) is handed out first, and items of equal key keep their
+    order.  key is called in the background thread.
+    """
+    queue = Queue.PriorityQueue(maxsize=size) if key else \
+        Queue.Queue(maxsize=size)
+    order = itertools.count()
+    done = object()
+
+    # The end sorts after every item, and items never compare
+    # themselves, only their key and position.
+    def produce():
+        try:
+            for item in iterable:
+                queue.put((False, key(item) if key else None, next(order),
+                           item, None))
+        except BaseException:
+            queue.put((True, None, next(order), done, sys.exc_info()))
+        else:
+            queue.put((True, None, next(order), done, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+
+    while True:
+        item, exc_info = queue.get()[3:]
+        if item is done:
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            return
+        yield item
+
+
 def default_parser(doc):
 
     parser = argparse.ArgumentParser(
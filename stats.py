@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Per-stage latency histograms and counters for ingest and task push.
+
+Stages time themselves with
+
+    with stats.timer('do_pybossa'):
+        ...
+
+and count things with stats.incr('bytes_read', len(raw)).  At the end
+of a run report() logs a JSON summary, or Prometheus text format, so
+the rw_io.set_logging() handlers (and --flog) capture it.
+
+Timings are per process: stages that run in a --numcores worker pool
+are not included.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return dict(count=0)
+        return dict(count=self.count,
+                    total_s=round(self.sum, 6),
+                    mean_ms=round(1000 * self.sum / self.count, 3),
+                    min_ms=round(1000 * self.min, 3),
+                    p50_ms=round(1000 * self.quantile(0.50), 3),
+                    p99_ms=round(1000 * self.quantile(0.99), 3),
+                    max_ms=round(1000 * self.max, 3))
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.histograms = {}
+            self.counters = {}
+            self.errors = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def error(self, stage, n=1):
+        with self.lock:
+            self.errors[stage] = self.errors.get(stage, 0) + n
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the block as `stage`; exceptions count as its errors."""
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.error(stage)
+            raise
+        finally:
+            self.observe(stage, time.time() - start)
+
+    def summary(self):
+        with self.lock:
+            return dict(
+                wall_s=round(time.time() - self.started, 3),
+                stages=dict((stage, h.summary())
+                            for stage, h in self.histograms.iteritems()),
+                counters=dict(self.counters),
+                errors=dict(self.errors))
+
+    def prometheus(self, prefix='app_translate'):
+        """The stats in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            name = '%s_stage_seconds' % prefix
+            lines.append('# TYPE %s histogram' % name)
+            for stage, h in sorted(self.histograms.iteritems()):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, h.counts):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d' % (
+                        name, stage, le, cumulative))
+                lines.append('%s_sum{stage="%s"} %r' % (name, stage, h.sum))
+                lines.append('%s_count{stage="%s"} %d' % (name, stage,
+                                                          h.count))
+            for counter, n in sorted(self.counters.iteritems()):
+                lines.append('# TYPE %s_%s_total counter' % (prefix, counter))
+                lines.append('%s_%s_total %d' % (prefix, counter, n))
+            name = '%s_errors_total' % prefix
+            lines.append('# TYPE %s counter' % name)
+            for stage, n in sorted(self.errors.iteritems()):
+                lines.append('%s{stage="%s"} %d' % (name, stage, n))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, logger, format='json'):
+        if format == 'prometheus':
+            logger.info('Stats:\n%s' % self.prometheus())
+        else:
+            logger.info('Stats: %s' % json.dumps(self.summary(),
+                                                  sort_keys=True))
+
+
+# The registry the ingest and task push stages record into.
+STATS = Stats()
+timer = STATS.timer
+incr = STATS.incr
+error = STATS.error
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run pbclient calls from a bounded thread pool over keep-alive HTTP."""
+
+import collections
+from multiprocessing.pool import ThreadPool
+
+import pbclient
+import requests
+
+
+def use_session(pool_size):
+    """Make pbclient send its requests through one pooled Session.
+
+    pbclient calls requests.get/post/put/delete at module level, which
+    opens a new connection each time.  A Session has the same methods
+    and keeps up to `pool_size` connections alive for the workers.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    pbclient.requests = session
+    return session
+
+
+def failed(result):
+    """pbclient returns the HTTP status code instead of raising."""
+    return isinstance(result, (int, long)) and not isinstance(result, bool)
+
+
+def imap(func, iterable, workers=1):
+    """Yield (item, result, error) for func(item), in input order.
+
+    With more than one worker the calls run in a thread pool.  At most
+    2 * workers items are taken from `iterable` ahead of the consumer,
+    so a lazy iterable is never drained into memory.  `error` is the
+    exception raised by func, or None.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield _call(func, item)
+        return
+
+    pool = ThreadPool(workers)
+    pending = collections.deque()
+    try:
+        for item in iterable:
+            pending.append(pool.apply_async(_call, (func, item)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _call(func, item):
+    try:
+        return item, func(item), None
+    except Exception, err:
+        return item, None, err
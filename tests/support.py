@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Throwaway Maildirs and a fake PyBossa for the tests."""
+
+import json
+import mailbox
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+
+import createTasks
+import get_emails
+import pbclient
+from pbfake import FakePyBossa
+
+APP_JSON = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'app.json')
+
+
+class FailingPyBossa(FakePyBossa):
+    """A FakePyBossa whose task POSTs fail while fail(n) says so.
+
+    n counts task POSTs from 1; every other request is served.
+    """
+
+    def __init__(self, fail=lambda n: False, **kwargs):
+        FakePyBossa.__init__(self, **kwargs)
+        self.fail = fail
+        self.n_posts = 0
+
+    def handle(self, method, path, query, body):
+        if method == 'POST' and path.rstrip('/').endswith('/task'):
+            with self.lock:
+                self.n_posts += 1
+                n = self.n_posts
+            if self.fail(n):
+                return 500, dict(status='failed', status_code=500)
+        return FakePyBossa.handle(self, method, path, query, body)
+
+
+class PipelineTestCase(unittest.TestCase):
+    """A SyriaSpeakingGmail root under a temporary directory, and a
+    fake PyBossa server with the app of app.json on it."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='app-translate-test')
+        self.addCleanup(shutil.rmtree, self.root)
+        get_emails.set_root(self.root)
+        self.inbox = mailbox.Maildir(get_emails.INBOX, factory=None,
+                                     create=True)
+        with open(APP_JSON) as fp:
+            self.app_config = json.load(fp)
+        self.fake = self.start_fake()
+
+    def start_fake(self, **kwargs):
+        fake = FailingPyBossa(**kwargs).start()
+        self.addCleanup(fake.stop)
+        fake.add('app', dict(short_name=self.app_config['short_name'],
+                             name=self.app_config['name']))
+        return fake
+
+    def add_message(self, subject, body, age=0):
+        """Add a plain text message sent `age` seconds ago to INBOX."""
+        self.inbox.add('From: sender@example.com\n'
+                       'Subject: %s\n'
+                       'Date: %s\n'
+                       '\n'
+                       '%s\n' % (subject, formatdate(time.time() - age),
+                                 body))
+
+    def create_tasks(self, *args):
+        """Run createTasks.py -x with `args`, quietly."""
+        sys.argv = ['createTasks.py', '-s', self.fake.url, '-k', 'test',
+                    '-x'] + list(args)
+        options = createTasks.handle_arguments()
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            createTasks.run(self.app_config, options)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            # Close the keep-alive connections api_client.install() opened,
+            # so no server thread outlives the test.
+            pbclient.requests.session.close()
+
+    def tasks(self):
+        return [task for task_id, task in sorted(self.fake.tables['task']
+                                                 .items())]
+
+    def n_messages(self, maildir):
+        return sum(len(os.listdir(os.path.join(maildir, subdir)))
+                   for subdir in ('new', 'cur'))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Consensus of task run answers."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import aggregate
+
+
+def taskrun(taskrun_id, task_id, answer):
+    return dict(id=taskrun_id, task_id=task_id, info=dict(english=answer))
+
+
+class GroupTaskrunsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='app-translate-test')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_groups_interleaved_runs_by_task(self):
+        runs = [taskrun(1, 20, u'b'), taskrun(2, 10, u' a '),
+                taskrun(3, 20, u'c'), taskrun(4, 30, None),
+                taskrun(5, 10, u'd')]
+        self.assertEqual(list(aggregate.group_taskruns(runs, self.tmpdir)),
+                         [(10, [(2, u'a'), (5, u'd')]),
+                          (20, [(1, u'b'), (3, u'c')]),
+                          (30, [(4, u'')])])
+        # The spool file is gone.
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_no_runs(self):
+        self.assertEqual(list(aggregate.group_taskruns([], self.tmpdir)), [])
+
+
+@unittest.skipUnless(aggregate.NUMPY, 'needs numpy')
+class ConsensusTest(unittest.TestCase):
+
+    def test_most_similar_answer_wins(self):
+        runs = [taskrun(1, 1, u'the water is cut in the city'),
+                taskrun(2, 1, u'spam'),
+                taskrun(3, 1, u'water is cut in the city'),
+                taskrun(4, 2, u'only answer'),
+                taskrun(5, 3, u''),
+                taskrun(6, 1, u'water is cut in the city today')]
+        results = list(aggregate.consensus(aggregate.group_taskruns(runs)))
+        self.assertEqual([(result['task_id'], result['taskrun_id'],
+                           result['n_runs'], result['n_answers'])
+                          for result in results],
+                         [(1, 3, 4, 4), (2, 4, 1, 1), (3, None, 1, 0)])
+        self.assertTrue(0 < results[0]['agreement'] < 1)
+        self.assertEqual(results[1]['agreement'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Task files written and read back by bulk.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import bulk
+
+ROWS = [dict(msg_key='1', question=u'Translate', n_answers=30,
+             msgs_text=u'مرحبا ' * 50000, msgs_html=[u'<p>مرحبا</p>'],
+             msg_subject=u'', msg_date=None, priority_0=0.25),
+        dict(msg_key='2', question=u'Translate', n_answers=30,
+             msgs_text=u'Part 2 of 2\n\nnull', msgs_html=[],
+             msg_subject=u'"quoted", with a comma',
+             msg_date='Mon, 1 Jul 2013 10:00:00 +0000',
+             msg_attachments=[dict(sha256='ab' * 32, size=3)],
+             msg_id='<a@b>', msg_part=2, msg_parts=2)]
+
+
+class TaskFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='app-translate-test')
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def round_trip(self, name):
+        path = os.path.join(self.tmpdir, name)
+        self.assertEqual(bulk.write_tasks(path, iter(ROWS)), len(ROWS))
+        return list(bulk.read_tasks(path))
+
+    def test_csv_round_trip(self):
+        # The first body is far over the csv module's default cell limit.
+        self.assertTrue(len(ROWS[0]['msgs_text'].encode('utf-8')) > 131072)
+        self.assertEqual(self.round_trip('tasks.csv'), ROWS)
+
+    def test_json_round_trip(self):
+        self.assertEqual(self.round_trip('tasks.json'), ROWS)
+
+    def test_csv_and_json_payloads_match(self):
+        self.assertEqual(self.round_trip('tasks.csv'),
+                         self.round_trip('tasks.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
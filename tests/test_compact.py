@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Trimming and splitting message bodies."""
+
+import unittest
+
+from compact import MAX_CHARS
+from compact import compact_text
+from compact import split_text
+
+
+class CompactTextTest(unittest.TestCase):
+
+    def test_drops_quoted_reply_and_attribution(self):
+        text = (u'Thank you.\n'
+                u'\n'
+                u'On Mon, 1 Jul 2013, someone wrote:\n'
+                u'> The question\n'
+                u'>> and an older one\n')
+        self.assertEqual(compact_text(text), u'Thank you.')
+
+    def test_arabic_attribution(self):
+        text = (u'شكرا\n'
+                u'في 1 يوليو 2013، كتب أحدهم:\n'
+                u'> السؤال\n')
+        self.assertEqual(compact_text(text), u'شكرا')
+
+    def test_attribution_without_quote_is_kept(self):
+        text = u'On Monday he wrote:\nthe letter was long.'
+        self.assertEqual(compact_text(text), text)
+
+    def test_stops_at_signature_and_original_message(self):
+        self.assertEqual(compact_text(u'Hello\n-- \nName\nPhone'), u'Hello')
+        self.assertEqual(compact_text(u'Hello\n----- Original Message -----\n'
+                                      u'Earlier text'), u'Hello')
+
+    def test_collapses_whitespace(self):
+        self.assertEqual(compact_text(u'  a \t b c  \n\n\n\n\nd  '),
+                         u'a b c\n\nd')
+
+
+class SplitTextTest(unittest.TestCase):
+
+    def check(self, text, max_chars):
+        pieces = split_text(text, max_chars)
+        for piece in pieces:
+            self.assertTrue(0 < len(piece) <= max_chars, piece)
+        # Nothing is lost but the whitespace at the cuts.
+        self.assertEqual(u''.join(u''.join(pieces).split()),
+                         u''.join(text.split()))
+        return pieces
+
+    def test_text_of_max_chars_is_not_split(self):
+        text = u'x' * MAX_CHARS
+        self.assertEqual(split_text(text), [text])
+        self.assertEqual(split_text(text, 0), [text])
+
+    def test_one_char_over_max_chars_is_split(self):
+        text = u'word ' * (MAX_CHARS / 5) + u'x'
+        self.assertEqual(len(text), MAX_CHARS + 1)
+        pieces = self.check(text, MAX_CHARS)
+        self.assertEqual(len(pieces), 2)
+        self.assertEqual(pieces[1], u'x')
+
+    def test_prefers_paragraphs_then_lines_then_words(self):
+        self.assertEqual(self.check(u'aaaa bbbb\ncccc\n\ndddd', 16),
+                         [u'aaaa bbbb\ncccc', u'dddd'])
+        self.assertEqual(self.check(u'aaaa bbbb\ncccc dddd', 16),
+                         [u'aaaa bbbb', u'cccc dddd'])
+        self.assertEqual(self.check(u'aaaa bbbb cccc dddd', 16),
+                         [u'aaaa bbbb cccc', u'dddd'])
+
+    def test_text_without_spaces_is_cut_at_max_chars(self):
+        self.assertEqual(self.check(u'x' * 25, 10),
+                         [u'x' * 10, u'x' * 10, u'x' * 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""createTasks.py -x against a fake PyBossa."""
+
+import unittest
+
+import get_emails
+from tests.support import PipelineTestCase
+
+# Two paragraphs, split into two tasks by --max-chars 80.
+LONG_BODY = ('The first paragraph, with enough words to fill a task.\n'
+             '\n'
+             'The second paragraph, with enough words for another one.')
+
+
+class DuplicateSplitMessageTest(PipelineTestCase):
+
+    def parts(self):
+        return sorted((task['info']['msg_part'], task['info']['msg_parts'])
+                      for task in self.tasks())
+
+    def test_failed_part_keeps_duplicates_waiting(self):
+        for age in (300, 200, 100):
+            self.add_message('Same message', LONG_BODY, age)
+        # The second part of the oldest copy fails.
+        self.fake.fail = lambda n: n == 2
+        self.create_tasks('--max-chars', '80')
+        self.assertEqual(self.parts(), [(1, 2)])
+        self.assertEqual(self.n_messages(get_emails.INBOX), 3)
+
+        self.fake.fail = lambda n: False
+        self.create_tasks('--max-chars', '80')
+        self.assertEqual(self.parts(), [(1, 2), (2, 2)])
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+        self.assertEqual(
+            self.n_messages(get_emails.PROCESSED_MESSAGES_DIR), 3)
+
+    def test_random_failures_post_each_part_once(self):
+        for i in xrange(20):
+            self.add_message('Message %d' % i, LONG_BODY, 100 * i)
+            self.add_message('Message %d' % i, LONG_BODY, 100 * i + 50)
+        # Two runs fail two task POSTs in five, then one completes.
+        failures = iter([True, False, False, True, False] * 100)
+        self.fake.fail = lambda n: next(failures)
+        self.create_tasks('--max-chars', '80')
+        self.create_tasks('--max-chars', '80')
+        self.fake.fail = lambda n: False
+        self.create_tasks('--max-chars', '80')
+
+        posted = sorted((task['info']['msg_subject'],
+                         task['info']['msg_part']) for task in self.tasks())
+        self.assertEqual(posted, sorted(set(posted)))
+        self.assertEqual(len(posted), 40)
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+
+
+class CompactBodiesTest(PipelineTestCase):
+
+    REPLY = 'Thank you.\n\nOn Monday, someone wrote:\n> The question'
+
+    def test_full_bodies_only_for_that_run(self):
+        self.add_message('Reply', self.REPLY)
+        self.create_tasks('--full-bodies')
+        self.add_message('Reply', self.REPLY)
+        self.create_tasks('--no-dedup')
+        self.assertEqual([task['info']['msgs_text']
+                          for task in self.tasks()],
+                         [self.REPLY, 'Thank you.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Scanning and parsing INBOX."""
+
+import unittest
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate
+
+import get_emails
+import stats
+from tests.support import PipelineTestCase
+
+ATTACHMENT_BYTES = 1024 * 1024
+
+
+class ScanTest(PipelineTestCase):
+
+    def add_attachment_message(self, i):
+        message = MIMEMultipart()
+        message['From'] = 'sender@example.com'
+        message['Subject'] = 'Message %d' % i
+        message['Date'] = formatdate(1372672800 + 60 * i)
+        message.attach(MIMEText('Text %d' % i))
+        message.attach(MIMEApplication('\0' * ATTACHMENT_BYTES))
+        self.inbox.add(message)
+
+    def test_scan_reads_only_headers(self):
+        for i in (2, 0, 1):
+            self.add_attachment_message(i)
+        stats.STATS.reset()
+        entries = get_emails.scan_maildir(get_emails.INBOX)
+        self.assertTrue(stats.STATS.counters['bytes_read'] < 3 * 1024)
+        self.assertEqual([entry.message()['subject'] for entry in entries],
+                         ['Message 0', 'Message 1', 'Message 2'])
+
+    def test_numcores_gives_the_same_payloads(self):
+        for i in xrange(6):
+            self.add_attachment_message(i)
+        entries = get_emails.scan_maildir(get_emails.INBOX)
+        payloads = [get_emails.process_msg(entry)[1] for entry in entries]
+        self.assertEqual([ret['msgs_text'] for ret in payloads],
+                         ['Text %d' % i for i in xrange(6)])
+        self.assertEqual([(entry, ret) for entry, ret
+                          in get_emails.parse_parallel(entries, 2)],
+                         zip(entries, payloads))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""The ingest journal, and archiving through it."""
+
+import json
+import mailbox
+import os
+import shutil
+import tempfile
+import unittest
+
+import get_emails
+from journal import ARCHIVED
+from journal import CREATED
+from journal import PARSED
+from journal import IngestJournal
+from tests.support import PipelineTestCase
+
+
+class IngestJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp(prefix='app-translate-test')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.path = os.path.join(tmpdir, 'INBOX.journal')
+
+    def lines(self):
+        with open(self.path) as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_resume_after_crash(self):
+        journal = IngestJournal(self.path)
+        journal.record('a', PARSED)
+        journal.record('a', CREATED, 7)
+        journal.record('b', PARSED)
+        journal.record('c', PARSED)
+        journal.record('c', CREATED, 8)
+        journal.record('c', ARCHIVED, 8)
+        # No close(): the process died, half way through a line.
+        journal.fp.write('{"key": "b", "sta')
+        journal.fp.flush()
+
+        journal = IngestJournal(self.path)
+        self.assertEqual((journal.state('a'), journal.task_id('a')),
+                         (CREATED, 7))
+        self.assertEqual(journal.state('b'), PARSED)
+        self.assertEqual(journal.state('c'), ARCHIVED)
+        self.assertEqual(journal.state('d'), None)
+        self.assertEqual(journal.keys(CREATED), ['a'])
+        journal.close()
+
+    def test_parts(self):
+        journal = IngestJournal(self.path)
+        journal.record('a', PARSED)
+        self.assertEqual(journal.record_part('a', 1, 10), {1: 10})
+        self.assertEqual(journal.record_part('a', 3, 12), {1: 10, 3: 12})
+        journal.record('b', PARSED)
+        journal.record_part('b', 1, 20)
+        journal.record('b', CREATED, 20)
+
+        journal = IngestJournal(self.path)
+        self.assertEqual(journal.posted_parts('a'), {1: 10, 3: 12})
+        self.assertEqual(journal.state('a'), PARSED)
+        # Parts are forgotten once the message is created.
+        self.assertEqual(journal.posted_parts('b'), {})
+        journal.close()
+
+    def test_close_compacts(self):
+        journal = IngestJournal(self.path)
+        for key in ('a', 'b', 'c'):
+            journal.record(key, PARSED)
+        journal.record('a', CREATED, 1)
+        journal.record('a', ARCHIVED, 1)
+        journal.record('b', CREATED, 2)
+        journal.record_part('c', 2, 3)
+        journal.close()
+
+        self.assertEqual(sorted((line['key'], line['state'],
+                                 line.get('part'), line['task_id'])
+                                for line in self.lines()),
+                         [('b', CREATED, None, 2),
+                          ('c', PARSED, None, None),
+                          ('c', PARSED, 2, 3)])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        journal = IngestJournal(self.path)
+        self.assertEqual(journal.state('a'), None)
+        self.assertEqual(journal.state('b'), CREATED)
+        self.assertEqual(journal.posted_parts('c'), {2: 3})
+        journal.close()
+
+
+class ArchiveTest(PipelineTestCase):
+
+    def entries(self):
+        return get_emails.scan_maildir(get_emails.INBOX)
+
+    def test_archive_renames_under_the_same_name(self):
+        for i in xrange(3):
+            self.add_message('Message %d' % i, 'Text %d' % i)
+        entries = self.entries()
+        pybossa = mailbox.Maildir(get_emails.PROCESSED_MESSAGES_DIR,
+                                  factory=None, create=True)
+        archived = get_emails.archive_msgs([(entry, None)
+                                            for entry in entries],
+                                           self.inbox, pybossa)
+        self.assertEqual(archived, entries)
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+        for entry in entries:
+            self.assertTrue(os.path.exists(os.path.join(
+                get_emails.PROCESSED_MESSAGES_DIR, entry.subpath)))
+
+    def test_archive_copies_when_the_name_is_taken(self):
+        self.add_message('Message', 'Text')
+        entry, = self.entries()
+        pybossa = mailbox.Maildir(get_emails.PROCESSED_MESSAGES_DIR,
+                                  factory=None, create=True)
+        taken = os.path.join(get_emails.PROCESSED_MESSAGES_DIR, entry.subpath)
+        with open(taken, 'w') as fp:
+            fp.write('Subject: Another message\n\n')
+        self.assertEqual(get_emails.archive_msgs([(entry, None)],
+                                                 self.inbox, pybossa),
+                         [entry])
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+        self.assertEqual(
+            self.n_messages(get_emails.PROCESSED_MESSAGES_DIR), 2)
+
+    def test_archive_created_moves_only_created(self):
+        for i in xrange(3):
+            self.add_message('Message %d' % i, 'Text %d' % i)
+        keys = [entry.key for entry in self.entries()]
+        journal = IngestJournal(get_emails.INBOX_JOURNAL)
+        journal.record(keys[0], CREATED, 1)
+        journal.record(keys[1], PARSED)
+        self.assertEqual(get_emails.archive_created(journal), 1)
+        self.assertEqual(journal.state(keys[0]), ARCHIVED)
+        self.assertEqual(journal.task_id(keys[0]), 1)
+        self.assertEqual(sorted(key for key, subpath
+                                in get_emails.list_maildir(get_emails.INBOX)),
+                         sorted(keys[1:]))
+        journal.close()
+
+
+class ResumeTest(PipelineTestCase):
+
+    def subjects(self):
+        return sorted(task['info']['msg_subject'] for task in self.tasks())
+
+    def test_failed_tasks_are_posted_by_the_next_run(self):
+        for i in xrange(10):
+            self.add_message('Message %d' % i, 'Text %d' % i, 10 * i)
+        self.fake.fail = lambda n: n % 3 == 0
+        self.create_tasks()
+        self.assertEqual(len(self.tasks()), 7)
+        self.assertEqual(self.n_messages(get_emails.INBOX), 3)
+
+        self.fake.fail = lambda n: False
+        self.create_tasks()
+        self.assertEqual(self.subjects(),
+                         sorted('Message %d' % i for i in xrange(10)))
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+        self.assertEqual(
+            self.n_messages(get_emails.PROCESSED_MESSAGES_DIR), 10)
+
+    def test_created_messages_are_archived_after_a_crash(self):
+        for i in xrange(4):
+            self.add_message('Message %d' % i, 'Text %d' % i, 10 * i)
+        # A run that died after creating tasks for two messages and
+        # before archiving them.
+        entries = get_emails.scan_maildir(get_emails.INBOX)
+        journal = IngestJournal(get_emails.INBOX_JOURNAL)
+        for entry in entries[:2]:
+            journal.record(entry.key, PARSED)
+            task = self.fake.add('task', dict(info=dict(
+                msg_subject=entry.message()['subject'])))
+            journal.record(entry.key, CREATED, task['id'])
+        journal.fp.close()
+
+        self.create_tasks()
+        self.assertEqual(self.subjects(),
+                         sorted('Message %d' % i for i in xrange(4)))
+        self.assertEqual(self.n_messages(get_emails.INBOX), 0)
+        # close() kept nothing of the archived messages.
+        self.assertEqual(os.path.getsize(get_emails.INBOX_JOURNAL), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
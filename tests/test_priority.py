@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Task priorities."""
+
+import time
+import unittest
+from email.utils import formatdate
+
+import priority
+
+
+class RecencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = priority.Scorer(dict(weights=dict(recency=1.0,
+                                                        sender=0.0,
+                                                        keywords=0.0)))
+
+    def score(self, date):
+        return self.scorer(dict(msg_date=date, msgs_text=u''))
+
+    def test_fresh_message_scores_highest(self):
+        now = time.time()
+        self.assertEqual(self.score(formatdate(now)), 1.0)
+        self.assertEqual(self.scorer(dict(msg_date=formatdate(now - 86400),
+                                          msgs_text=u''), now), 0.5)
+
+    def test_broken_date_scores_zero(self):
+        for date in (None, '', 'not a date', 'Mon, 1 Jan 1800 00:00:00',
+                     'Mon, 1 Jan 9999999 00:00:00 +0000'):
+            self.assertEqual(self.score(date), 0.0, date)
+
+
+class ByPriorityTest(unittest.TestCase):
+
+    def messages(self, scores, error=None):
+        for i, score in enumerate(scores):
+            yield dict(n=i, score=score)
+        if error is not None:
+            raise error
+
+    def test_buffered_messages_come_highest_score_first(self):
+        msgs = priority.by_priority(self.messages([0.5, 0.1, 0.9, 0.1, 0.3]),
+                                    lambda msg: msg['score'])
+        first = next(msgs)
+        # Let the producer fill the buffer.
+        time.sleep(0.1)
+        self.assertEqual(first['n'], 0)
+        self.assertEqual([(msg['n'], msg['priority_0']) for msg in msgs],
+                         [(2, 0.9), (4, 0.3), (1, 0.1), (3, 0.1)])
+
+    def test_producer_errors_come_after_its_messages(self):
+        msgs = priority.by_priority(
+            self.messages([0.1, 0.2], ValueError('broken')),
+            lambda msg: msg['score'])
+        self.assertEqual(next(msgs)['n'], 0)
+        time.sleep(0.1)
+        self.assertEqual(next(msgs)['n'], 1)
+        self.assertRaises(ValueError, next, msgs)
+
+
+if __name__ == '__main__':
+    unittest.main()
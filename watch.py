@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of PyBOSSA.
+#
+# PyBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PyBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PyBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Wait for mail to arrive in a Maildir's new/ and cur/ directories.
+
+Uses inotify through pyinotify when it is installed, and otherwise
+polls the directories' mtimes, which change whenever a message file
+is added, renamed or removed.
+"""
+
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+SUBDIRS = ('new', 'cur')
+
+
+def watch_maildir(path, interval=5.0, settle=1.0):
+    """Yield each time messages have arrived in the Maildir at `path`.
+
+    Yields once straight away for the mail already there.  After the
+    first change, changes during the next `settle` seconds are folded
+    into the same wakeup, so a burst of deliveries is handled as one
+    batch.  Changes made while the consumer handles a wakeup (including
+    its own archiving) cause one more.  `interval` is the polling period
+    when inotify is not available.
+    """
+    dirs = [os.path.join(path, subdir) for subdir in SUBDIRS]
+    if pyinotify is not None:
+        return _watch_inotify(dirs, settle)
+    return _watch_poll(dirs, interval, settle)
+
+
+def _watch_poll(dirs, interval, settle):
+    def snapshot():
+        return [os.stat(d).st_mtime for d in dirs]
+
+    while True:
+        seen = snapshot()
+        yield
+        while snapshot() == seen:
+            time.sleep(interval)
+        time.sleep(settle)
+
+
+class _Changed(object):
+    """pyinotify event handler that only notes that something happened."""
+
+    def __init__(self):
+        self.changed = False
+
+    def __call__(self, event):
+        self.changed = True
+
+
+def _watch_inotify(dirs, settle):
+    # Maildir deliveries are complete when they appear in new/: they
+    # are written in tmp/ and then linked (IN_CREATE) or renamed
+    # (IN_MOVED_TO) across.
+    mask = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO
+    handler = _Changed()
+    wm = pyinotify.WatchManager()
+    notifier = pyinotify.Notifier(wm, default_proc_fun=handler)
+    wm.add_watch(dirs, mask)
+    try:
+        while True:
+            handler.changed = False
+            yield
+            # Events queued while the consumer was busy count too.
+            while not handler.changed:
+                if notifier.check_events(timeout=None):
+                    notifier.read_events()
+                    notifier.process_events()
+            deadline = time.time() + settle
+            while time.time() < deadline:
+                timeout = int(1000 * max(0, deadline - time.time()))
+                if notifier.check_events(timeout=timeout):
+                    notifier.read_events()
+                    notifier.process_events()
+    finally:
+        notifier.stop()